@@ -9,60 +9,53 @@ import queue
 from asyncio import sleep as asleep
 from asyncio import iscoroutine
 
-# Load bot core
-from core import config, console, database, locales, cfg_factory
-from core.client import dc
-
-# Load bot
-import bot
-
-# Load web server
-if config.cfg.WS_ENABLE:
-	from webui import webserver
-else:
-	webserver = False
-
-log = console.log
 
 # Gracefully exit on ctrl+c
-original_SIGINT_handler = signal.getsignal(signal.SIGINT)
-
-
 def ctrl_c(sig, frame):
 	bot.save_state()
 	console.terminate()
 	signal.signal(signal.SIGINT, original_SIGINT_handler)
 
 
-signal.signal(signal.SIGINT, ctrl_c)
-
-
 # Run commands from user console
 async def run_console():
 	try:
 		cmd = console.user_input_queue.get(False)
 	except queue.Empty:
 		return
+	await run_command(cmd)
 
+
+# Evaluate a console command, log and return the result
+async def run_command(cmd):
 	log.info(cmd)
 	try:
 		x = eval(cmd)
 		if iscoroutine(x):
-			log.info(await x)
-		else:
-			log.info(str(x))
+			x = await x
+		log.info(str(x))
+		return x
 	except Exception as e:
 		log.error("CONSOLE| ERROR: "+str(e))
+		return "ERROR: "+str(e)
 
 
 # Background processes loop
 async def think():
+	watchdog.watchdog.start(asyncio.get_running_loop())
+	await metrics.start(dc)
+	if getattr(config.cfg, 'ADMIN_SOCKET', None):
+		await console.admin_socket.start(config.cfg.ADMIN_SOCKET, run_command)
 	for task in dc.events['on_init']:
 		await task()
 
 	# Loop runs roughly every 1 second
+	last_frame = None
 	while console.alive:
 		frame_time = time.time()
+		if last_frame is not None:
+			metrics.think_lag_seconds.observe(max(frame_time - last_frame - 1, 0))
+		last_frame = frame_time
 		await run_console()
 		for task in dc.events['on_think']:
 			try:
@@ -72,6 +65,7 @@ async def think():
 		await asleep(1)
 
 	# Exit signal received
+	watchdog.watchdog.stop()
 	for task in dc.events['on_exit']:
 		try:
 			await task()
@@ -83,6 +77,9 @@ async def think():
 
 	log.info("Closing db.")
 	await database.db.close()
+	executor.cpu_executor.close()
+	await metrics.server.close()
+	await console.admin_socket.close()
 	if webserver:
 		log.info("Closing web server.")
 		webserver.srv.close()
@@ -92,10 +89,34 @@ async def think():
 	print("Exit now.")
 	loop.stop()
 
-# Login to discord
-loop = asyncio.get_event_loop()
-loop.create_task(think())
-loop.create_task(dc.start(config.cfg.DC_BOT_TOKEN))
 
-log.info("Connecting to discord...")
-loop.run_forever()
+# The start-up is guarded, as the CPU executor worker processes import the main module
+if __name__ == "__main__":
+	# Load bot core
+	from core import config, console, database, executor, watchdog, metrics
+	# Not used here, imported to be available in the console commands eval() namespace
+	from core import locales, cfg_factory, profiler
+	from core.client import dc
+
+	# Load bot
+	import bot
+
+	# Load web server
+	if config.cfg.WS_ENABLE:
+		from webui import webserver
+	else:
+		webserver = False
+
+	log = console.log
+
+	original_SIGINT_handler = signal.getsignal(signal.SIGINT)
+	signal.signal(signal.SIGINT, ctrl_c)
+
+	# Login to discord
+	loop = asyncio.get_event_loop()
+	loop.run_until_complete(database.db.migrate())
+	loop.create_task(think())
+	loop.create_task(dc.start(config.cfg.DC_BOT_TOKEN))
+
+	log.info("Connecting to discord...")
+	loop.run_forever()
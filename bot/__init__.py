@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from .main import update_qc_lang, update_rating_system, save_state
+from .main import update_qc_lang, update_rating_system, update_queues_index, save_state
 from .main import load_state, enable_channel, disable_channel
 from .main import remove_players, expire_auto_ready
 
@@ -8,6 +8,7 @@ from .queue_channel import QueueChannel
 from .queues.pickup_queue import PickupQueue
 from .queues.common import QueueResponses as Qr
 from .match.match import Match
+from .match.registry import MatchRegistry
 from .expire import expire
 from .stats import stats
 from .stats.noadds import noadds
@@ -22,7 +23,7 @@ bot_was_ready = False
 bot_ready = False
 queue_channels = dict()  # {channel.id: QueueChannel()}
 active_queues = []
-active_matches = []
+active_matches = MatchRegistry()
 waiting_reactions = dict()  # {message.id: function}
 allow_offline = []  # [user_id]
 auto_ready = dict()  # {user.id: timestamp}
@@ -1,6 +1,6 @@
 __all__ = [
 	'noadds', 'noadd', 'forgive', 'rating_seed', 'rating_penality', 'rating_hide',
-	'rating_reset', 'rating_snap', 'stats_reset', 'stats_reset_player', 'stats_replace_player',
+	'rating_reset', 'rating_snap', 'rating_recompute', 'stats_reset', 'stats_reset_player', 'stats_replace_player',
 	'phrases_add', 'phrases_clear', 'undo_match'
 ]
 
@@ -9,6 +9,7 @@ from datetime import timedelta
 from nextcord import Member
 
 from core.utils import seconds_to_str, get_nick
+from core.console import log
 
 import bot
 
@@ -93,14 +94,50 @@ async def rating_reset(ctx):
 
 async def rating_snap(ctx):
 	ctx.check_perms(ctx.Perms.ADMIN)
-	await ctx.qc.rating.snap_ratings(ctx.qc._ranks_table)
+	await ctx.qc.rating.snap_ratings(ctx.qc.ranks)
 	await ctx.success(ctx.qc.gt("Done."))
 
 
+async def _run_rating_recompute(ctx):
+	""" Background part of the ratings recompute, reports progress to the invoking channel """
+	async def progress(replay):
+		await ctx.notice(ctx.qc.gt("Recomputing ratings... {count} matches replayed.").format(count=replay.matches))
+
+	try:
+		replay = await bot.stats.recompute_ratings(ctx.qc, progress=progress)
+	except Exception as e:
+		log.error(f"Ratings recompute failed on channel {ctx.qc.id}: {str(e)}")
+		await ctx.error(ctx.qc.gt("Ratings recompute failed, the ratings may be partially saved, run it again."))
+	else:
+		await ctx.success(ctx.qc.gt("Ratings are recomputed: {summary}.").format(summary=replay.summary()))
+
+
+async def rating_recompute(ctx):
+	ctx.check_perms(ctx.Perms.ADMIN)
+	if ctx.qc.rating.channel_id != ctx.qc.id:
+		raise bot.Exc.ValueError("This channel uses rating data of another channel, run the recompute there.")
+	bot.stats.jobs.start_job(ctx.qc.id, _run_rating_recompute(bot.SystemContext(ctx.qc)))
+	await ctx.success(ctx.qc.gt("Ratings recompute is started, progress will be reported in this channel."))
+
+
+async def _run_stats_reset(ctx, reset, *args):
+	""" Background part of the stats resets, reports progress to the invoking channel """
+	async def progress(deleted):
+		await ctx.notice(ctx.qc.gt("Resetting stats... {count} rows deleted.").format(count=deleted))
+
+	try:
+		deleted = await reset(ctx.qc.id, *args, progress=progress)
+	except Exception as e:
+		log.error(f"Stats reset failed on channel {ctx.qc.id}: {str(e)}")
+		await ctx.error(ctx.qc.gt("Stats reset failed, try again later."))
+	else:
+		await ctx.success(ctx.qc.gt("Stats reset is complete, {count} rows deleted.").format(count=deleted))
+
+
 async def stats_reset(ctx):
 	ctx.check_perms(ctx.Perms.ADMIN)
-	await bot.stats.reset_channel(ctx.qc.id)
-	await ctx.success(ctx.qc.gt("Done."))
+	bot.stats.jobs.start_job(ctx.qc.id, _run_stats_reset(bot.SystemContext(ctx.qc), bot.stats.reset_channel))
+	await ctx.success(ctx.qc.gt("Stats reset is started, progress will be reported in this channel."))
 
 
 async def stats_reset_player(ctx, player: str):
@@ -108,8 +145,10 @@ async def stats_reset_player(ctx, player: str):
 	if (player := await ctx.get_member(player)) is None:
 		raise bot.Exc.SyntaxError(f"Specified member not found on the server.")
 
-	await bot.stats.reset_player(ctx.qc.id, player.id)
-	await ctx.success(ctx.qc.gt("Done."))
+	bot.stats.jobs.start_job(
+		ctx.qc.id, _run_stats_reset(bot.SystemContext(ctx.qc), bot.stats.reset_player, player.id)
+	)
+	await ctx.success(ctx.qc.gt("Stats reset is started, progress will be reported in this channel."))
 
 
 async def stats_replace_player(ctx, player1: str, player2: str):
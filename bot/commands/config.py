@@ -27,6 +27,7 @@ async def delete_queue(ctx, queue: str):
 		raise bot.Exc.NotFoundError(f"Queue '{queue}' not found on the channel..")
 	await q.cfg.delete()
 	ctx.qc.queues.remove(q)
+	ctx.qc.update_queues_index()
 	await show_queues(ctx)
 
 
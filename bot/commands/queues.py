@@ -21,9 +21,7 @@ async def add(ctx, queues: str = None):
 
 	# select queues requested by user
 	elif len(targets):
-		t_queues = [q for q in ctx.qc.queues if any(
-			(t == q.name.lower() or t in (a["alias"].lower() for a in q.cfg.aliases) for t in targets)
-		)]
+		t_queues = ctx.qc.find_queues(targets)
 
 	# select active queues or default queues if no active queues
 	else:
@@ -59,11 +57,7 @@ async def remove(ctx, queues: str = None):
 	if not len(targets):
 		t_queues = [q for q in ctx.qc.queues if q.is_added(ctx.author)]
 	else:
-		t_queues = [
-			q for q in ctx.qc.queues if
-			any((t == q.name.lower() or t in (a["alias"].lower() for a in q.cfg.aliases) for t in targets)) and
-			q.is_added(ctx.author)
-		]
+		t_queues = [q for q in ctx.qc.find_queues(targets) if q.is_added(ctx.author)]
 
 	if len(t_queues):
 		for q in t_queues:
@@ -82,17 +76,14 @@ async def who(ctx, queues: str = None):
 	targets = queues.lower().split(" ") if queues else []
 
 	if len(targets):
-		t_queues = [
-			q for q in ctx.qc.queues if
-			any((t == q.name.lower() or t in (a["alias"].lower() for a in q.cfg.aliases) for t in targets))
-		]
+		t_queues = ctx.qc.find_queues(targets)
 	else:
 		t_queues = [q for q in ctx.qc.queues if len(q.queue)]
 
 	if not len(t_queues):
 		await ctx.reply(f"> {ctx.qc.gt('no players')}")
 	else:
-		await ctx.reply("\n".join([f"> **{q.name}** ({q.status}) | {q.who}" for q in t_queues]))
+		await ctx.reply("\n".join([f"> {q.topic_line}" for q in t_queues]))
 
 
 async def add_player(ctx, player: Member, queue: str):
@@ -180,10 +171,7 @@ async def subscribe(ctx, queues: str = None, unsub: bool = False):
 	if not queues:
 		roles = [ctx.qc.cfg.promotion_role] if ctx.qc.cfg.promotion_role else []
 	else:
-		queues = queues.split(" ")
-		roles = (q.cfg.promotion_role for q in ctx.qc.queues if q.cfg.promotion_role and any(
-			(t == q.name.lower() or t in (a["alias"].lower() for a in q.cfg.aliases) for t in queues)
-		))
+		roles = (q.cfg.promotion_role for q in ctx.qc.find_queues(queues.lower().split(" ")) if q.cfg.promotion_role)
 
 	if unsub:
 		roles = [r for r in roles if r in ctx.author.roles]
@@ -1,4 +1,4 @@
-__all__ = ['last_game', 'stats', 'top', 'rank', 'leaderboard']
+__all__ = ['last_game', 'history', 'stats', 'top', 'rank', 'leaderboard']
 
 from time import time
 from nextcord import Member, Embed, Colour
@@ -11,39 +11,26 @@ import bot
 
 async def last_game(ctx, queue: str = None, player: Member = None, match_id: int = None):
 	lg = None
+	kwargs = dict()
 
 	if match_id:
-		lg = await db.select_one(
-			['*'], "qc_matches", where=dict(channel_id=ctx.qc.id, match_id=match_id), order_by="match_id", limit=1
-		)
-
+		kwargs['match_id'] = match_id
 	elif queue:
-		if queue := find(lambda q: q.name.lower() == queue.lower(), ctx.qc.queues):
-			lg = await db.select_one(
-				['*'], "qc_matches", where=dict(channel_id=ctx.qc.id, queue_id=queue.id), order_by="match_id", limit=1
-			)
+		if (queue := find(lambda q: q.name.lower() == queue.lower(), ctx.qc.queues)) is None:
+			raise bot.Exc.NotFoundError(ctx.qc.gt("Nothing found"))
+		kwargs['queue_id'] = queue.id
+	elif player:
+		if (member := await ctx.get_member(player)) is None:
+			raise bot.Exc.NotFoundError(ctx.qc.gt("Nothing found"))
+		kwargs['user_id'] = member.id
 
-	elif player and (member := await ctx.get_member(player)) is not None:
-		if match := await db.select_one(
-			['match_id'], "qc_player_matches", where=dict(channel_id=ctx.qc.id, user_id=member.id),
-			order_by="match_id", limit=1
-		):
-			lg = await db.select_one(
-				['*'], "qc_matches", where=dict(channel_id=ctx.qc.id, match_id=match['match_id'])
-			)
-
-	else:
-		lg = await db.select_one(
-			['*'], "qc_matches", where=dict(channel_id=ctx.qc.id), order_by="match_id", limit=1
-		)
+	if len(data := (await bot.stats.match_history(ctx.qc.id, limit=1, **kwargs))['matches']):
+		lg = data[0]
 
 	if not lg:
 		raise bot.Exc.NotFoundError(ctx.qc.gt("Nothing found"))
 
-	players = await db.select(
-		['user_id', 'nick', 'team'], "qc_player_matches",
-		where=dict(match_id=lg['match_id'])
-	)
+	players = lg['players']
 	embed = Embed(colour=Colour(0x50e3c2))
 	embed.add_field(name=lg['queue_name'], value=seconds_to_str(int(time()) - lg['at']) + " ago")
 	if len(team := [p['nick'] for p in players if p['team'] == 0]):
@@ -61,6 +48,41 @@ async def last_game(ctx, queue: str = None, player: Member = None, match_id: int
 	await ctx.reply(embed=embed)
 
 
+async def history(ctx, queue: str = None, player: Member = None, ranked: bool = None, before: int = None):
+	kwargs = dict()
+	if queue:
+		if (queue := find(lambda q: q.name.lower() == queue.lower(), ctx.qc.queues)) is None:
+			raise bot.Exc.NotFoundError(ctx.qc.gt("Nothing found"))
+		kwargs['queue_id'] = queue.id
+	if player:
+		if (member := await ctx.get_member(player)) is None:
+			raise bot.Exc.SyntaxError(ctx.qc.gt("Specified user not found."))
+		kwargs['user_id'] = member.id
+	if ranked is not None:
+		kwargs['ranked'] = int(ranked)
+
+	data = await bot.stats.match_history(ctx.qc.id, before=before, limit=10, **kwargs)
+	if not len(data['matches']):
+		raise bot.Exc.NotFoundError(ctx.qc.gt("Nothing found"))
+
+	rows = []
+	for m in data['matches']:
+		if not m['ranked']:
+			result = "-"
+		elif m['winner'] is None:
+			result = ctx.qc.gt('Draw')
+		else:
+			result = [m['alpha_name'], m['beta_name']][m['winner']]
+		rows.append([
+			m['match_id'], m['queue_name'], seconds_to_str(int(time()) - m['at']) + " ago", len(m['players']), result
+		])
+
+	content = discord_table(["ID", ctx.qc.gt("Queue"), ctx.qc.gt("Played"), ctx.qc.gt("Players"), ctx.qc.gt("Winner")], rows)
+	if data['next'] is not None:
+		content += "\n" + ctx.qc.gt("Next page: `before {match_id}`").format(match_id=data['next'])
+	await ctx.reply(content)
+
+
 async def stats(ctx, player: Member = None):
 	if player:
 		if (member := await ctx.get_member(player)) is not None:
@@ -1,8 +1,10 @@
 import traceback
+import time
 import re
 from typing import Callable
 
 from core.client import dc
+from core import metrics
 from core.console import log
 from core.utils import get_nick, parse_duration
 
@@ -36,37 +38,41 @@ async def on_message(message):
 
 	# special commands
 	if re.match(r"^\+..", message.content):
-		f, args = _commands.get('add'), [message.content[1:]]
+		name, args = 'add', [message.content[1:]]
 	elif re.match(r"^-..", message.content):
-		f, args = _commands.get('remove'), [message.content[1:]]
+		name, args = 'remove', [message.content[1:]]
 	elif message.content == "++":
-		f, args = _commands.get('add'), []
+		name, args = 'add', []
 	elif message.content == "--":
-		f, args = _commands.get('remove'), []
+		name, args = 'remove', []
 
 	elif message.content[0] == qc.cfg.prefix:
 		cmd_args = message.content[1:].split(' ', 1)
-		f = _commands.get(cmd_args[0])
+		name = cmd_args[0]
 		args = cmd_args[1:]
 
 	else:
 		return
 
+	f = _commands.get(name)
 	if f is not None:
 		ctx = MessageContext(qc, message)
-		log.command("{} | #{} | {}: {}".format(
-			ctx.channel.guild.name, ctx.channel.name, get_nick(message.author), message.content
-		))
+		log.command(
+			"%s | #%s | %s: %s", ctx.channel.guild.name, ctx.channel.name, get_nick(message.author), message.content
+		)
 
 		if not bot.bot_ready:
 			await ctx.error("Bot is under connection, please try agian later...", title="Error")
 			return
 
+		at, outcome = time.perf_counter(), "ok"
 		try:
-			await f(ctx, *args)
+			await qc.execute(f(ctx, *args))
 		except bot.Exc.PubobotException as e:
+			outcome = "rejected"
 			await ctx.error(str(e), title=e.__class__.__name__)
 		except Exception as e:
+			outcome = "error"
 			await ctx.error(str(e), title="RuntimeError")
 			log.error("\n".join([
 				f"Error processing a text message command.",
@@ -75,6 +81,8 @@ async def on_message(message):
 				f"Content: `{message.content}`.",
 				f"Exception: {str(e)}. Traceback:\n{traceback.format_exc()}=========="
 			]))
+		metrics.commands_total.inc(command=name, outcome=outcome)
+		metrics.command_seconds.observe(time.perf_counter() - at, command=name)
 
 
 @message_command('add', 'j')
@@ -227,6 +235,22 @@ async def _lastgame(ctx: MessageContext, args: str = None):
 		await bot.commands.last_game(ctx, queue=args)
 
 
+@message_command('history', 'matches_history')
+async def _history(ctx: MessageContext, args: str = ""):
+	""" Usage: history [@player|queue] [before match_id] """
+	args = args.split() if args else []
+	before = None
+	if len(args) >= 2 and args[-2] == "before" and args[-1].isdigit():
+		before = int(args[-1])
+		args = args[:-2]
+	if not len(args):
+		await bot.commands.history(ctx, before=before)
+	elif (member := await ctx.get_member(" ".join(args))) is not None:
+		await bot.commands.history(ctx, player=member, before=before)
+	else:
+		await bot.commands.history(ctx, queue=" ".join(args), before=before)
+
+
 @message_command('cancel_match', 'match_cancel')
 async def _cancel_match(ctx: MessageContext, args: str = None):
 	if not args or not args.isdigit():
@@ -6,6 +6,7 @@ import traceback
 import time
 
 from core.client import dc
+from core import metrics
 from core.utils import error_embed, ok_embed, parse_duration, get_nick
 from core.console import log
 from core.config import cfg
@@ -53,23 +54,28 @@ async def run_slash(coro: Callable, interaction: Interaction, **kwargs):
 
 
 async def run_slash_coro(ctx: SlashContext, coro: Callable, **kwargs):
-	log.command("{} | #{} | {}: /{} {}".format(
-		ctx.channel.guild.name, ctx.channel.name, get_nick(ctx.author), coro.__name__, kwargs
-	))
+	log.command(
+		"%s | #%s | %s: /%s %s", ctx.channel.guild.name, ctx.channel.name, get_nick(ctx.author), coro.__name__, kwargs
+	)
 
+	at, outcome = time.perf_counter(), "ok"
 	try:
-		await coro(ctx, **kwargs)
+		await ctx.qc.execute(coro(ctx, **kwargs))
 	except bot.Exc.PubobotException as e:
+		outcome = "rejected"
 		await ctx.error(str(e), title=e.__class__.__name__)
 	except Exception as e:
+		outcome = "error"
 		await ctx.error(str(e), title="RuntimeError")
 		log.error("\n".join([
 			f"Error processing /slash command {coro.__name__}.",
-			f"QC: {ctx.channel.guild.name}>#{ctx.channel.name} ({qc.id}).",
+			f"QC: {ctx.channel.guild.name}>#{ctx.channel.name} ({ctx.qc.id}).",
 			f"Member: {ctx.author} ({ctx.author.id}).",
 			f"Kwargs: {kwargs}.",
 			f"Exception: {str(e)}. Traceback:\n{traceback.format_exc()}=========="
 		]))
+	metrics.commands_total.inc(command=coro.__name__, outcome=outcome)
+	metrics.command_seconds.observe(time.perf_counter() - at, command=coro.__name__)
 
 
 @groups.admin_queue.subcommand(name='create_pickup', description='Create new pickup queue.')
@@ -377,6 +383,12 @@ async def _rating_snap(
 ): await run_slash(bot.commands.rating_snap, interaction=interaction)
 
 
+@groups.admin_rating.subcommand(name='recompute', description='Recompute ratings from the matches history.')
+async def _rating_recompute(
+		interaction: Interaction
+): await run_slash(bot.commands.rating_recompute, interaction=interaction)
+
+
 # stats -> ...
 
 @groups.admin_stats.subcommand(name='show', description='Show channel or player stats.')
@@ -573,6 +585,19 @@ async def _last_game(
 _last_game.on_autocomplete("queue")(autocomplete.queues)
 
 
+@dc.slash_command(name='history', description='Show matches history.', **guild_kwargs)
+async def _history(
+		interaction: Interaction,
+		queue: str = SlashOption(required=False),
+		player: Member = SlashOption(required=False, verify=False),
+		ranked: bool = SlashOption(required=False),
+		before: int = SlashOption(required=False, description="Show matches older than this match id.")
+): await run_slash(
+	bot.commands.history, interaction=interaction, queue=queue, player=player, ranked=ranked, before=before
+)
+_history.on_autocomplete("queue")(autocomplete.queues)
+
+
 @dc.slash_command(name='top', description='Show top players on the channel.', **guild_kwargs)
 async def _top(
 		interaction: Interaction,
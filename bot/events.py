@@ -1,22 +1,35 @@
+import asyncio
 import traceback
 from nextcord import ChannelType, Activity, ActivityType
 
 from core.client import dc
 from core.console import log
 from core.config import cfg
+from core.utils import nick_cache
+from core import metrics
 import bot
 
+metrics.active_queues.set_function(lambda: len(bot.active_queues))
+metrics.active_matches.set_function(lambda: len(bot.active_matches))
+metrics.expire_timers.set_function(lambda: len(bot.expire.tasks))
+
+think_tasks = dict()  # {channel_id: Task} of the channels matches think in progress
+
 
 @dc.event
 async def on_init():
 	await bot.stats.check_match_id_counter()
 
 
-@dc.event
-async def on_think(frame_time):
-	for match in bot.active_matches:
+async def _think_match(match, frame_time):
+	if match in bot.active_matches:  # could be finished while waiting for the channel lock
+		await match.think(frame_time)
+
+
+async def _think_matches(qc, matches, frame_time):
+	for match in matches:
 		try:
-			await match.think(frame_time)
+			await qc.execute(_think_match(match, frame_time))
 		except Exception as e:
 			log.error("\n".join([
 				f"Error at Match.think().",
@@ -24,7 +37,20 @@ async def on_think(frame_time):
 				f"{str(e)}. Traceback:\n{traceback.format_exc()}=========="
 			]))
 			bot.active_matches.remove(match)
-			break
+
+
+@dc.event
+async def on_think(frame_time):
+	# every channel matches think in its own task, so a busy channel lock does not stall the loop,
+	# channels with the previous think still waiting for the lock skip this tick
+	channels = dict()
+	for match in bot.active_matches:
+		channels.setdefault(match.qc.id, (match.qc, []))[1].append(match)
+	for channel_id, (qc, matches) in channels.items():
+		if channel_id not in think_tasks:
+			think_tasks[channel_id] = task = asyncio.create_task(_think_matches(qc, matches, frame_time))
+			task.add_done_callback(lambda t, channel_id=channel_id: think_tasks.pop(channel_id, None))
+
 	await bot.expire.think(frame_time)
 	await bot.noadds.think(frame_time)
 	await bot.stats.jobs.think(frame_time)
@@ -103,13 +129,31 @@ async def on_presence_update(before, after):
 
 	for qc in filter(lambda i: i.guild_id == after.guild.id, bot.queue_channels.values()):
 		if after.raw_status == "offline" and qc.cfg.remove_offline:
-			await qc.remove_members(after, reason="offline")
+			await qc.execute(qc.remove_members(after, reason="offline"))
 
 		if after.raw_status == "idle" and qc.cfg.remove_afk and bot.expire.get(qc, after) is None:
-			await qc.remove_members(after, reason="afk", highlight=True)
+			await qc.execute(qc.remove_members(after, reason="afk", highlight=True))
 
 
 @dc.event
 async def on_member_remove(member):
 	for qc in filter(lambda i: i.id == member.guild.id, bot.queue_channels.values()):
-		await qc.remove_members(member, reason="left guild")
+		await qc.execute(qc.remove_members(member, reason="left guild"))
+
+
+@dc.event
+async def on_member_update(before, after):
+	if before.nick != after.nick:
+		nick_cache.invalidate(after.id)
+		for q in bot.active_queues:
+			if q.is_added(after):
+				q.mark_dirty()
+
+
+@dc.event
+async def on_user_update(before, after):
+	if before.name != after.name:
+		nick_cache.invalidate(after.id)
+		for q in bot.active_queues:
+			if q.is_added(after):
+				q.mark_dirty()
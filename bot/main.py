@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import traceback
 import json
 from nextcord import Interaction
@@ -51,6 +52,13 @@ def update_rating_system(qc_cfg):
 	bot.queue_channels[qc_cfg.p_key].update_rating_system()
 
 
+def update_queues_index(pq_cfg):
+	for qc in bot.queue_channels.values():
+		if any((q.cfg is pq_cfg for q in qc.queues)):
+			qc.update_queues_index()
+			return
+
+
 def save_state():
 	log.info("Saving state...")
 	queues = []
@@ -98,9 +106,20 @@ async def load_state():
 		await bot.expire.load_json(data['expire'])
 
 
+async def _remove_members(qc, users, reason):
+	try:
+		await qc.execute(qc.remove_members(*users, reason=reason))
+	except Exception as e:
+		log.error(f"Failed to remove players from channel {qc.id}: {str(e)}\n{traceback.format_exc()}")
+
+
 async def remove_players(*users, reason=None):
+	"""
+	Remove the users from the queues on all channels, every channel removal is serialized with its other mutations.
+	The callers usually hold their own channel lock, so the removals are scheduled instead of awaited.
+	"""
 	for qc in set((q.qc for q in bot.active_queues)):
-		await qc.remove_members(*users, reason=reason)
+		asyncio.create_task(_remove_members(qc, users, reason))
 
 
 async def expire_auto_ready(frame_time):
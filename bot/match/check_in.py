@@ -86,6 +86,9 @@ class CheckIn:
 		await self.m.next_state(ctx)
 
 	async def process_reaction(self, reaction, user, remove=False):
+		await self.m.qc.execute(self._process_reaction(reaction, user, remove=remove))
+
+	async def _process_reaction(self, reaction, user, remove=False):
 		if self.m.state != self.m.CHECK_IN or user not in self.m.players:
 			return
 
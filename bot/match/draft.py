@@ -105,6 +105,7 @@ class Draft:
 			old_team.remove(player)
 		else:
 			self.m.players.append(player)
+			bot.active_matches.update_players(self.m)
 			self.m.ratings = {
 				p['user_id']: p['rating'] for p in await self.m.qc.rating.get_players((p.id for p in self.m.players))
 			}
@@ -134,6 +135,7 @@ class Draft:
 		team[team.index(player1)] = player2
 		self.m.players.remove(player1)
 		self.m.players.append(player2)
+		bot.active_matches.update_players(self.m)
 		if player1 in self.sub_queue:
 			self.sub_queue.remove(player1)
 		self.m.ratings = {
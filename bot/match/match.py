@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from time import time
 from itertools import combinations
+from math import comb
 import random
 from nextcord import DiscordException
 
@@ -8,12 +9,22 @@ import bot
 from core.utils import find, get, iter_to_dict, join_and, get_nick
 from core.console import log
 from core.client import dc
+from core.executor import cpu_executor
 
 from .check_in import CheckIn
 from .draft import Draft
 from .embeds import Embeds
 
 
+def matchmake(ratings, team_len):
+	""" Return indexes of the team with rating sum closest to a half of total ratings sum """
+	best_rating = sum(ratings)/2
+	return min(
+		combinations(range(len(ratings)), team_len),
+		key=lambda team: abs(sum([ratings[i] for i in team])-best_rating)
+	)
+
+
 class Match:
 
 	INIT = 0
@@ -64,10 +75,10 @@ class Match:
 		# Prepare the Match object
 		match.maps = match.random_maps(match.cfg['maps'], match.cfg['map_count'], queue.last_maps)
 		match.init_captains(match.cfg['pick_captains'], match.cfg['captains_role_id'])
-		match.init_teams(match.cfg['pick_teams'])
+		await match.init_teams(match.cfg['pick_teams'])
 		if match.ranked:
 			match.states.append(match.WAITING_REPORT)
-		bot.active_matches.append(match)
+		bot.active_matches.add(match)
 
 	@classmethod
 	async def fake_ranked_match(cls, ctx, queue, qc, winners, losers, draw=False, **kwargs):
@@ -134,7 +145,7 @@ class Match:
 			ctx = bot.SystemContext(qc)
 			await match.check_in.start(ctx)  # Spawn a new check_in message
 
-		bot.active_matches.append(match)
+		bot.active_matches.add(match)
 
 	def __init__(self, match_id, queue, qc, players, ratings, **cfg):
 
@@ -207,18 +218,17 @@ class Match:
 				rand, key=lambda p: self.cfg['captains_role_id'] in [role.id for role in p.roles], reverse=True
 			)[:2]
 
-	def init_teams(self, pick_teams):
+	async def init_teams(self, pick_teams):
 		if pick_teams == "draft":
 			self.teams[0].set(self.captains[:1])
 			self.teams[1].set(self.captains[1:])
 			self.teams[2].set([p for p in self.players if p not in self.captains])
 		elif pick_teams == "matchmaking":
 			team_len = min(self.cfg['team_size'], int(len(self.players)/2))
-			best_rating = sum(self.ratings.values())/2
-			best_team = min(
-				combinations(self.players, team_len),
-				key=lambda team: abs(sum([self.ratings[m.id] for m in team])-best_rating)
-			)
+			ratings = [self.ratings[p.id] for p in self.players]
+			best_team = [self.players[i] for i in await cpu_executor.run(
+				matchmake, ratings, team_len, cost=comb(len(ratings), team_len) * team_len
+			)]
 			self.teams[0].set(self.sort_players(
 				best_team[:self.cfg['team_size']]
 			))
@@ -271,6 +281,7 @@ class Match:
 		if len(self.teams[2]):
 			for p in self.teams[2]:
 				self.players.remove(p)
+			bot.active_matches.update_players(self)
 			await ctx.notice(self.gt("{players} were removed from the match.").format(
 				players=join_and([m.mention for m in self.teams[2]])
 			))
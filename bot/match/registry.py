@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+
+class MatchRegistry:
+	""" Active matches storage indexed by match id, QueueChannel id and player id """
+
+	def __init__(self):
+		self._by_id = dict()  # {match_id: Match()}
+		self._by_qc = dict()  # {channel_id: {match_id: Match()}}
+		self._by_player = dict()  # {user_id: {match_id: Match()}} - a player may be in matches on several channels
+		self._player_ids = dict()  # {match_id: {user_id, ...}} - indexed players of each match
+
+	def __iter__(self):
+		return iter(list(self._by_id.values()))
+
+	def __len__(self):
+		return len(self._by_id)
+
+	def __contains__(self, match):
+		return self._by_id.get(match.id) is match
+
+	def add(self, match):
+		self._by_id[match.id] = match
+		self._by_qc.setdefault(match.qc.id, dict())[match.id] = match
+		self._player_ids[match.id] = set()
+		self.update_players(match)
+
+	def remove(self, match):
+		if self._by_id.get(match.id) is not match:
+			return
+		self._by_id.pop(match.id)
+		qc_matches = self._by_qc[match.qc.id]
+		qc_matches.pop(match.id)
+		if not len(qc_matches):
+			self._by_qc.pop(match.qc.id)
+		for user_id in self._player_ids.pop(match.id):
+			self._unindex_player(user_id, match)
+
+	def update_players(self, match):
+		""" Sync the players index, must be called after the match players list changes """
+		if (indexed := self._player_ids.get(match.id)) is None:
+			return
+		current = {p.id for p in match.players}
+		for user_id in indexed - current:
+			self._unindex_player(user_id, match)
+		for user_id in current:
+			self._by_player.setdefault(user_id, dict())[match.id] = match
+		self._player_ids[match.id] = current
+
+	def _unindex_player(self, user_id, match):
+		if (matches := self._by_player.get(user_id)) is None or matches.get(match.id) is not match:
+			return
+		matches.pop(match.id)
+		if not len(matches):
+			self._by_player.pop(user_id)
+
+	def get(self, match_id):
+		return self._by_id.get(match_id)
+
+	def of_qc(self, qc):
+		return list(self._by_qc.get(qc.id, dict()).values())
+
+	def of_player(self, user_id, qc=None):
+		""" Return the player active match on the qc channel, or any of the player matches if qc is not given """
+		matches = self._by_player.get(user_id, dict()).values()
+		return next((m for m in matches if qc is None or m.qc.id == qc.id), None)
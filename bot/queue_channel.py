@@ -1,16 +1,15 @@
 # -*- coding: utf-8 -*-
-import re
 import asyncio
 from enum import Enum
 from nextcord import Forbidden
 
 from core.cfg_factory import FactoryTable, CfgFactory, Variables, VariableTable
 from core.locales import locales
-from core.utils import join_and, seconds_to_str, get_nick
+from core.utils import join_and, seconds_to_str, get_nick, RATING_TAG_RE, PrefixTrie
 from core.database import db
 
 import bot
-from bot.stats.rating import FlatRating, Glicko2Rating, TrueSkillRating
+from bot.stats.rating import FlatRating, Glicko2Rating, TrueSkillRating, RanksTable
 
 MAX_EXPIRE_TIME = 12*60*60
 MAX_PROMOTION_DELAY = 12*60*60
@@ -306,6 +305,7 @@ class QueueChannel:
 
 		for pq_cfg in await bot.PickupQueue.cfg_factory.select(text_channel.guild, {"channel_id": self.id}):
 			self.queues.append(bot.PickupQueue(self, pq_cfg))
+		self.update_queues_index()
 
 		return self
 
@@ -327,6 +327,19 @@ class QueueChannel:
 		)
 		self.queues = []
 		self.last_promote = 0
+		self._ranks = None
+		self._queues_index = None  # {lowercase name or alias: [queues]}
+		self._queues_trie = None  # PrefixTrie of queue names
+		self.lock = asyncio.Lock()
+
+	async def execute(self, coro):
+		"""
+		Run a coroutine that mutates the channel state, serialized with other ones on this channel.
+		Commands on different channels are still executed concurrently.
+		Must not be awaited from inside another serialized coroutine of the same channel.
+		"""
+		async with self.lock:
+			return await coro
 
 	async def update_info(self, text_channel):
 		self.cfg.cfg_info['channel_name'] = text_channel.name
@@ -352,9 +365,11 @@ class QueueChannel:
 			ls_boost=self.cfg.rating_ls_boost
 		)
 
-	async def apply_rating_decay(self):
+	async def apply_rating_decay(self, tx=None):
 		if self.id == self.rating.channel_id and (self.cfg.rating_decay or self.cfg.rating_deviation_decay):
-			await self.rating.apply_decay(self.cfg.rating_decay or 0, self.cfg.rating_deviation_decay or 0, self._ranks_table)
+			await self.rating.apply_decay(
+				self.cfg.rating_decay or 0, self.cfg.rating_deviation_decay or 0, self.ranks, tx=tx
+			)
 
 	@property
 	def _ranks_table(self):
@@ -363,6 +378,40 @@ class QueueChannel:
 		else:
 			return self.cfg.ranks
 
+	@property
+	def ranks(self):
+		""" RanksTable of the current ranks config, rebuilt when the `ranks` variable gets a new value """
+		table = self._ranks_table
+		if self._ranks is None or self._ranks.source is not table:
+			self._ranks = RanksTable(table)
+		return self._ranks
+
+	def update_queues_index(self):
+		""" Drop the queue names lookup structures, must be called after queues or their names/aliases change """
+		self._queues_index = None
+		self._queues_trie = None
+
+	def _build_queues_index(self):
+		self._queues_index = dict()
+		for q in self.queues:
+			for key in {q.name.lower(), *(a["alias"].lower() for a in q.cfg.aliases)}:
+				self._queues_index.setdefault(key, []).append(q)
+		self._queues_trie = PrefixTrie((q.name, q.name) for q in self.queues)
+
+	def find_queues(self, targets):
+		""" Return queues matching any of given lowercase names or aliases, ordered as the channel queues """
+		if self._queues_index is None:
+			self._build_queues_index()
+		found = set()
+		for t in targets:
+			found.update(self._queues_index.get(t, ()))
+		return [q for q in self.queues if q in found]
+
+	def queue_names_by_prefix(self, prefix):
+		if self._queues_trie is None:
+			self._build_queues_index()
+		return self._queues_trie.find(prefix)
+
 	async def new_queue(self, ctx, name, size, kind):
 		kind.validate_name(name)
 		if 1 > size > 100:
@@ -372,6 +421,7 @@ class QueueChannel:
 
 		q_obj = await kind.create(ctx, name, size)
 		self.queues.append(q_obj)
+		self.update_queues_index()
 		return q_obj
 
 	@property
@@ -380,7 +430,7 @@ class QueueChannel:
 		if not len(populated):
 			return f"> {self.gt('no players')}"
 		elif len(populated) < 5:
-			return "\n".join([f"> **{q.name}** ({q.status}) | {q.who}" for q in populated])
+			return "\n".join([f"> {q.topic_line}" for q in populated])
 		else:
 			return "> [" + " | ".join([f"**{q.name}** ({q.status})" for q in populated]) + "]"
 
@@ -431,14 +481,9 @@ class QueueChannel:
 			await ctx.ignore(self.gt("Action had no effect"))
 
 	def rating_rank(self, rating):
-		table = self._ranks_table
-		below = sorted(
-			(rank for rank in table if rank['rating'] <= rating),
-			key=lambda r: r['rating'], reverse=True
-		)
-		if not len(below):
+		if (rank := self.ranks.rank(rating)) is None:
 			return {'rank': '〈?〉', 'rating': 0, 'role': None}
-		return below[0]
+		return rank
 
 	async def get_lb(self):
 		data = await db.select(
@@ -479,7 +524,7 @@ class QueueChannel:
 				if roles[member.id] is not None and roles[member.id] not in member.roles:
 					await member.add_roles(roles[member.id], reason="Rank update.")
 				if self.cfg.rating_nicks:
-					if member.nick and (x := re.match(r"^\[\d+\] (.+)", member.nick)):
+					if member.nick and (x := RATING_TAG_RE.match(member.nick)):
 						await member.edit(nick=f"[{ratings[member.id]}] " + x.group(1))
 					else:
 						await member.edit(nick=f"[{ratings[member.id]}] " + (member.nick or member.name))
@@ -521,7 +566,7 @@ class QueueChannel:
 				duration=seconds_to_str(ban_left)
 			))
 
-		if any((member in m.players for m in bot.active_matches)):
+		if bot.active_matches.of_player(member.id) is not None:
 			raise bot.Exc.InMatchError(self.gt("You are already in an active match."))
 
 		if queue:
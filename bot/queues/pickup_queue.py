@@ -22,7 +22,8 @@ class PickupQueue:
 				section="General",
 				notnull=True,
 				verify=lambda name: len(name) and not any((c in name for c in ": \t\n")),
-				verify_message="Invalid queue name. A queue name should be one word without +-: characters."
+				verify_message="Invalid queue name. A queue name should be one word without +-: characters.",
+				on_change=bot.update_queues_index
 			),
 			Variables.TextVar(
 				"description",
@@ -252,7 +253,8 @@ class PickupQueue:
 				description="Other names for this queue, you can also group queues by giving them a same alias.",
 				variables=[
 					Variables.StrVar("alias", notnull=True)
-				]
+				],
+				on_change=bot.update_queues_index
 			),
 			VariableTable(
 				"maps", display="Maps", section="Maps",
@@ -305,20 +307,48 @@ class PickupQueue:
 		self.qc = qc
 		self.cfg = cfg
 		self.id = self.cfg.p_key
-		self.queue = []
+		self._queue = []
+		self._topic_cache = None  # ((name, size), status, who)
 		self.last_maps = []
 
+	@property
+	def queue(self):
+		return self._queue
+
+	@queue.setter
+	def queue(self, players):
+		self._queue = players
+		self.mark_dirty()
+
+	def mark_dirty(self):
+		""" Drop the cached topic fragments, must be called after the players list or nicks change """
+		self._topic_cache = None
+
+	def _topic_fragments(self):
+		key = (self.cfg.name, self.cfg.size)
+		if self._topic_cache is None or self._topic_cache[0] != key:
+			self._topic_cache = (
+				key,
+				f"{len(self._queue)}/{self.cfg.size}",
+				"/".join([f"`{get_nick(m)}`" for m in self._queue])
+			)
+		return self._topic_cache
+
 	@property
 	def name(self):
 		return self.cfg.name
 
 	@property
 	def status(self):  # (length/max)
-		return f"{len(self.queue)}/{self.cfg.size}"
+		return self._topic_fragments()[1]
 
 	@property
 	def who(self):
-		return "/".join([f"`{get_nick(m)}`" for m in self.queue])
+		return self._topic_fragments()[2]
+
+	@property
+	def topic_line(self):
+		return f"**{self.name}** ({self.status}) | {self.who}"
 
 	@property
 	def length(self):
@@ -379,6 +409,7 @@ class PickupQueue:
 
 		if member not in self.queue:
 			self.queue.append(member)
+			self.mark_dirty()
 
 			if self not in bot.active_queues:
 				bot.active_queues.append(self)
@@ -399,6 +430,8 @@ class PickupQueue:
 		members = [member for member in self.queue if member.id in ids]
 		for m in members:
 			self.queue.remove(m)
+		if len(members):
+			self.mark_dirty()
 		return members
 
 	async def start(self, ctx):
@@ -463,6 +496,7 @@ class PickupQueue:
 		if self.cfg.autostart:
 			while len(self.queue) < self.cfg.size and len(old_players):
 				self.queue.append(old_players.pop(0))
+			self.mark_dirty()
 			if len(self.queue) >= self.cfg.size:
 				await self.start(ctx)
 				self.queue = list(old_players)
@@ -2,6 +2,10 @@
 import glicko2
 import trueskill
 import time
+import math
+from bisect import bisect_right
+
+import numpy as np
 
 from core.database import db
 from core.utils import find, get_nick
@@ -9,14 +13,128 @@ from core.utils import find, get_nick
 from bot.stats import stats
 
 
+class RanksTable:
+	""" Rank thresholds of a `ranks` config table, sorted once for bisect lookups """
+
+	def __init__(self, ranks):
+		self.source = ranks
+		# on equal ratings the upper one wins, so keep the first table row the last
+		self.ranks = [r for i, r in sorted(enumerate(ranks), key=lambda x: (x[1]['rating'], -x[0]))]
+		self.thresholds = [r['rating'] for r in self.ranks]
+		self.nonzero = sorted(set(i for i in self.thresholds if i != 0))
+
+	def rank(self, rating):
+		""" Return the highest rank row met by the rating or None """
+		if (idx := bisect_right(self.thresholds, rating)) == 0:
+			return None
+		return self.ranks[idx-1]
+
+	def floor(self, rating, default=0):
+		""" Return the highest non-zero rank threshold met by the rating or the default """
+		if (idx := bisect_right(self.nonzero, rating)) == 0:
+			return default
+		return max(self.nonzero[idx-1], default)
+
+
+def _erfc(x):
+	""" Vectorized trueskill.backends.erfc() """
+	z = np.abs(x)
+	t = 1. / (1. + z / 2.)
+	r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+		0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+			0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+				-0.82215223 + t * 0.17087277
+			)))
+		)))
+	)))
+	return np.where(x < 0, 2. - r, r)
+
+
+def _cdf(x):
+	return 0.5 * _erfc(-x / math.sqrt(2))
+
+
+def _pdf(x):
+	return 1 / math.sqrt(2 * math.pi) * np.exp(-(x ** 2 / 2))
+
+
+# glicko2.Player constants and defaults
+GLICKO2_SCALE = 173.7178
+GLICKO2_TAU = glicko2.Player._tau
+GLICKO2_VOL = glicko2.Player().vol
+
+
+def glicko2_update(rating, rd, opp_rating, opp_rd, score, vol=GLICKO2_VOL, tau=GLICKO2_TAU, eps=0.000001):
+	"""
+	Vectorized glicko2.Player.update_player() of players with a single game in the rating period.
+	Arguments are numpy arrays, return new (rating, rd) arrays.
+	The formulas follow the glicko2 module, including its volatility function using the rating instead of the rd.
+	"""
+	mu = (rating - 1500) / GLICKO2_SCALE
+	phi = rd / GLICKO2_SCALE
+	mu_j = (opp_rating - 1500) / GLICKO2_SCALE
+	phi_j = opp_rd / GLICKO2_SCALE
+
+	g = 1 / np.sqrt(1 + 3 * phi_j ** 2 / math.pi ** 2)
+	e = 1 / (1 + np.exp(-1 * g * (mu - mu_j)))
+	v = 1 / (g ** 2 * e * (1 - e))
+	delta = v * (g * (score - e))
+
+	# new volatility with the Illinois algorithm
+	a = np.log(vol ** 2) * np.ones(len(mu))
+
+	f_num = delta ** 2 - mu ** 2 - v
+	f_denom = mu ** 2 + v
+
+	def f(x):
+		ex = np.exp(x)
+		return (ex * (f_num - ex)) / (2 * ((f_denom + ex) ** 2)) - ((x - a) / (tau ** 2))
+
+	big = delta ** 2 > phi ** 2 + v
+	with np.errstate(invalid='ignore'):
+		B = np.where(big, np.log(np.where(big, delta ** 2 - phi ** 2 - v, 1)), 0)
+	k = np.ones(len(mu))
+	while (low := ~big & (f(a - k * math.sqrt(tau ** 2)) < 0)).any():
+		k += low
+	B = np.where(big, B, a - k * math.sqrt(tau ** 2))
+
+	A = a
+	fA, fB = f(A), f(B)
+	while (active := np.abs(B - A) > eps).any():
+		C = np.where(active, A + ((A - B) * fA) / (fB - fA), B)
+		fC = f(C)
+		swap = fC * fB <= 0
+		A = np.where(active & swap, B, A)
+		fA = np.where(active, np.where(swap, fB, fA / 2.0), fA)
+		B, fB = C, fC
+	vol = np.exp(A / 2)
+
+	phi = np.sqrt(phi ** 2 + vol ** 2)
+	phi = 1 / np.sqrt((1 / phi ** 2) + (1 / v))
+	mu = mu + phi ** 2 * (g * (score - e))
+	return mu * GLICKO2_SCALE + 1500, phi * GLICKO2_SCALE
+
+
+def _restore_rating(cls, params):
+	return cls(**params)
+
+
 class BaseRating:
 
 	table = "qc_players"
+	# Vectorized rating changes function, see rate_batch()
+	_changes_batch = None
 
 	def __init__(
 			self, channel_id, init_rp=1500, init_deviation=300, min_deviation=None, scale=100,
 			loss_scale=100, win_scale=100, draw_bonus=0, ws_boost=False, ls_boost=False
 	):
+		# constructor arguments, the rating objects are pickled as them, see __reduce__()
+		self.params = dict(
+			channel_id=channel_id, init_rp=init_rp, init_deviation=init_deviation, min_deviation=min_deviation,
+			scale=scale, loss_scale=loss_scale, win_scale=win_scale, draw_bonus=draw_bonus,
+			ws_boost=ws_boost, ls_boost=ls_boost
+		)
 		self.channel_id = channel_id
 		self.init_rp = init_rp
 		self.init_deviation = init_deviation
@@ -28,6 +146,11 @@ class BaseRating:
 		self.ws_boost = ws_boost
 		self.ls_boost = ls_boost
 
+	def __reduce__(self):
+		# rating systems may hold unpicklable state (the TrueSkill env), so the CPU executor
+		# processes rebuild the object from its plain constructor arguments instead
+		return _restore_rating, (self.__class__, self.params)
+
 	def _scale_win(self, r_change):
 		return r_change * self.win_scale
 
@@ -61,6 +184,107 @@ class BaseRating:
 		p['deviation'] = max(self.min_deviation, round(p['deviation'] + d_change))
 		return p
 
+	def _scale_changes_batch(self, rating, deviation, streak, r_change, d_change, score):
+		""" Vectorized _scale_changes(), return new (rating, deviation, streak) arrays """
+		loss, draw, win = score == -1, score == 0, score == 1
+		streak = np.where(
+			loss, np.where(streak >= 0, -1, streak - 1), np.where(draw, 0, np.where(streak <= 0, 1, streak + 1))
+		)
+		r_change = np.where(
+			loss, self._scale_loss(r_change), np.where(draw, self._scale_draw(r_change), self._scale_win(r_change))
+		) * self.scale
+		if self.ls_boost:
+			r_change = np.where(loss & (streak < -2), r_change * (np.minimum(-streak, 6) / 2), r_change)
+		if self.ws_boost:
+			r_change = np.where(win & (streak > 2), r_change * (np.minimum(streak, 6) / 2), r_change)
+
+		rating = np.maximum(0, np.round(rating + r_change))
+		deviation = np.maximum(self.min_deviation, np.round(deviation + d_change))
+		return rating, deviation, streak
+
+	def rate_batch(self, rating, deviation, streak, step, side, draw):
+		"""
+		Rate a batch of independent rating steps (match rounds without common players) at once.
+		Arguments are numpy arrays of the steps players, grouped by step: rating, deviation, streak,
+		step number from 0, side (0 for the winners, 1 for the losers) and the step draw flag.
+		Return new (rating, deviation, streak) arrays, same as rate() would give for each step.
+		"""
+		if self._changes_batch is None:
+			return self._rate_batch_sequential(rating, deviation, streak, step, side, draw)
+
+		r_change, d_change = self._changes_batch(rating, deviation, step, side, draw)
+		score = np.where(draw, 0, 1 - side * 2)
+		return self._scale_changes_batch(rating, deviation, streak, r_change, d_change, score)
+
+	@staticmethod
+	def series_rounds(wins, losses, draws=0):
+		""" Yield rounds winner team (0, 1 or None for a draw) of a series, won and lost rounds interleave """
+		n = 0
+		while n < wins or n < losses:
+			if n < wins:
+				yield 0
+			if n < losses:
+				yield 1
+			n += 1
+		for n in range(draws):
+			yield None
+
+	def rate_series(self, winners, losers, wins, losses, draws=0):
+		"""
+		Rate a series of rounds between the teams, equivalent to the sequence of rate() calls of series_rounds().
+		Return [winners, losers] after the last round.
+		"""
+		if self._changes_batch is None:
+			teams = [winners, losers]
+			for won in self.series_rounds(wins, losses, draws):
+				if won is None:
+					teams = self.rate(*teams, draw=True)
+				elif won == 0:
+					teams = self.rate(*teams)
+				else:
+					teams = self.rate(teams[1], teams[0])[::-1]
+			return teams
+
+		players = (*winners, *losers)
+		team = np.array([0] * len(winners) + [1] * len(losers))
+		rating = np.array([p['rating'] for p in players], dtype=float)
+		deviation = np.array([p['deviation'] for p in players], dtype=float)
+		streak = np.array([p['streak'] for p in players], dtype=np.int64)
+		step = np.zeros(len(players), dtype=np.int64)
+		no_draw, draw = np.zeros(len(players), dtype=bool), np.ones(len(players), dtype=bool)
+		sides = (team, team ^ 1)  # by the round winner team
+
+		for won in self.series_rounds(wins, losses, draws):
+			if won is None:
+				r_change, d_change = self._changes_batch(rating, deviation, step, team, draw)
+				score = np.zeros(len(players), dtype=np.int64)
+			else:
+				r_change, d_change = self._changes_batch(rating, deviation, step, sides[won], no_draw)
+				score = 1 - sides[won] * 2
+			rating, deviation, streak = self._scale_changes_batch(rating, deviation, streak, r_change, d_change, score)
+
+		players = [
+			dict(
+				p, rating=int(r), deviation=int(d), streak=s, wins=p['wins'] + (losses if t else wins),
+				losses=p['losses'] + (wins if t else losses), draws=p['draws'] + draws
+			) for p, r, d, s, t in zip(players, rating.tolist(), deviation.tolist(), streak.tolist(), team.tolist())
+		]
+		return [players[:len(winners)], players[len(winners):]]
+
+	def _rate_batch_sequential(self, rating, deviation, streak, step, side, draw):
+		rating, deviation, streak = rating.copy(), deviation.copy(), streak.copy()
+		for rows in np.split(np.arange(len(step)), np.flatnonzero(np.diff(step)) + 1):
+			teams = ([i for i in rows if side[i] == 0], [i for i in rows if side[i] == 1])
+			results = self.rate(*(
+				[dict(
+					rating=int(rating[i]), deviation=int(deviation[i]), streak=int(streak[i]), wins=0, losses=0, draws=0
+				) for i in team] for team in teams
+			), draw=bool(draw[rows[0]]))
+			for team, team_results in zip(teams, results):
+				for i, p in zip(team, team_results):
+					rating[i], deviation[i], streak[i] = p['rating'], p['deviation'], p['streak']
+		return rating, deviation, streak
+
 	async def get_players(self, user_ids):
 		""" Return rating or initial rating for each member """
 		data = await db.select(
@@ -122,14 +346,23 @@ class BaseRating:
 	async def hide_player(self, user_id, hide=True):
 		await db.update(self.table, dict(is_hidden=hide), keys=dict(channel_id=self.channel_id, user_id=user_id))
 
-	async def snap_ratings(self, ranks_table):
-		ranks = [i['rating'] for i in ranks_table if i['rating'] != 0]
-		lowest = min(ranks)
-		data = await db.select(('*',), self.table, where=dict(channel_id=self.channel_id))
+	async def _update_ratings(self, rows, tx=None):
+		""" Write back (user_id, rating, deviation) of the changed players """
+		await (tx or db).insert_many(self.table, (
+			dict(channel_id=self.channel_id, user_id=user_id, rating=rating, deviation=deviation)
+			for user_id, rating, deviation in rows
+		), on_dublicate='update', update=('rating', 'deviation'))
+
+	async def snap_ratings(self, ranks):
+		lowest = min(ranks.nonzero)
+		data = await db.select(('user_id', 'rating', 'deviation'), self.table, where=dict(channel_id=self.channel_id))
 		history = []
+		to_update = []
 		now = int(time.time())
 		for p in (p for p in data if p['rating'] is not None):
-			new_rating = max([i for i in ranks if i <= p['rating']] + [lowest])
+			new_rating = ranks.floor(p['rating'], default=lowest)
+			if new_rating == p['rating']:
+				continue
 			history.append(dict(
 				user_id=p['user_id'],
 				channel_id=self.channel_id,
@@ -141,14 +374,15 @@ class BaseRating:
 				match_id=None,
 				reason="ratings snap"
 			))
-			p['rating'] = new_rating
-		await db.insert_many(self.table, data, on_dublicate='replace')
-		await db.insert_many('qc_rating_history', history)
+			to_update.append((p['user_id'], new_rating, p['deviation']))
 
-	async def apply_decay(self, rating, deviation, ranks_table):
-		""" Apply weekly rating and deviation decay """
+		if len(history):
+			await self._update_ratings(to_update)
+			await db.insert_many('qc_rating_history', history)
+
+	async def apply_decay(self, rating, deviation, ranks, tx=None):
+		""" Apply weekly rating and deviation decay, the changes are written within the tx transaction if given """
 		now = int(time.time())
-		ranks = [i['rating'] for i in ranks_table if i['rating'] != 0]
 		data = await stats.last_games(self.channel_id)
 		history = []
 		to_update = []
@@ -158,7 +392,7 @@ class BaseRating:
 
 			new_deviation = min((self.init_deviation, p['deviation'] + deviation))
 
-			min_rating = max([i for i in ranks if i <= p['rating']]+[0])
+			min_rating = ranks.floor(p['rating'])
 			if min_rating != 0 and p['at'] < (now-(60*60*24*7)):
 				new_rating = max((min_rating, p['rating']-rating))
 			else:
@@ -176,14 +410,11 @@ class BaseRating:
 					match_id=None,
 					reason="inactivity rating decay"
 				))
-				p.pop('at')
-				p['deviation'] = new_deviation
-				p['rating'] = new_rating
-				to_update.append(p)
+				to_update.append((p['user_id'], new_rating, new_deviation))
 
 		if len(history):
-			await db.insert_many('qc_rating_history', history)
-			await db.insert_many(self.table, to_update, on_dublicate='replace')
+			await (tx or db).insert_many('qc_rating_history', history)
+			await self._update_ratings(to_update, tx=tx)
 
 	async def reset(self):
 		data = await db.select(('user_id', 'rating', 'deviation'), self.table, where=dict(channel_id=self.channel_id))
@@ -219,6 +450,25 @@ class FlatRating(BaseRating):
 	def _scale_draw(self, r_change):
 		return 10 * self.draw_bonus
 
+	def _changes_batch(self, rating, deviation, step, side, draw):
+		return np.where(draw, 0, np.where(side == 0, 10, -10)), np.zeros(len(rating))
+
+	def rate_series(self, winners, losers, wins, losses, draws=0):
+		""" The changes do not depend on the other players, so every player is rated through the series alone """
+		rounds = list(self.series_rounds(wins, losses, draws))
+		results = [[], []]
+		for team, players in enumerate((winners, losers)):
+			for p in players:
+				for won in rounds:
+					if won is None:
+						p = self._scale_changes(p, 0, 0, 0)
+					elif won == team:
+						p = self._scale_changes(p, 10, 0, 1)
+					else:
+						p = self._scale_changes(p, -10, 0, -1)
+				results[team].append(p)
+		return results
+
 	def rate(self, winners, losers, draw=False):
 		r1, r2 = [], []
 		if not draw:
@@ -237,44 +487,41 @@ class FlatRating(BaseRating):
 
 
 class Glicko2Rating(BaseRating):
+	"""
+	Every player is rated as a single game between the team average rating with the player deviation
+	and the opponents team average rating and deviation.
+	"""
 
 	def __init__(self, **kwargs):
 		super().__init__(**kwargs)
 
+	def _changes_batch(self, rating, deviation, step, side, draw):
+		steps = step[-1] + 1
+		team = step * 2 + side
+		sizes = np.bincount(team, minlength=steps * 2)
+		avg_rating = np.trunc(np.bincount(team, weights=rating, minlength=steps * 2) / sizes)
+		avg_deviation = np.trunc(np.bincount(team, weights=deviation, minlength=steps * 2) / sizes)
+		opponents = team ^ 1
+
+		new_rating, new_deviation = glicko2_update(
+			avg_rating[team], deviation, avg_rating[opponents], avg_deviation[opponents],
+			np.where(draw, 0.5, np.where(side == 0, 1.0, 0.0))
+		)
+		return new_rating - avg_rating[team], new_deviation - deviation
+
 	def rate(self, winners, losers, draw=False):
-		score_w = 0.5 if draw else 1
-		score_l = 0.5 if draw else 0
-		r1, r2 = [], []
-		print("Scores:")
-		print(score_l, score_w)
+		players = (*winners, *losers)
+		side = np.array([0] * len(winners) + [1] * len(losers))
+		r_changes, d_changes = self._changes_batch(
+			np.array([p['rating'] for p in players], dtype=float), np.array([p['deviation'] for p in players], dtype=float),
+			np.zeros(len(players), dtype=np.int64), side, np.full(len(players), draw)
+		)
 
-		avg_w = [
-			[int(sum((p['rating'] for p in winners)) / len(winners))],  # average rating
-			[int(sum((p['deviation'] for p in winners)) / len(winners))],  # average deviation
-			[score_l]
-		]
-		avg_l = [
-			[int(sum((p['rating'] for p in losers)) / len(losers))],  # average rating
-			[int(sum((p['deviation'] for p in losers)) / len(losers))],  # average deviation
-			[score_w]
+		results = [
+			self._scale_changes(p, r_change, d_change, 0 if draw else 1 - s * 2)
+			for p, r_change, d_change, s in zip(players, r_changes.tolist(), d_changes.tolist(), side.tolist())
 		]
-
-		po = glicko2.Player()
-		for p in winners:
-			po.setRating(avg_w[0][0])
-			po.setRd(p['deviation'])
-			po.update_player(*avg_l)
-			new = self._scale_changes(p, po.getRating() - avg_w[0][0], po.getRd() - p['deviation'], 0 if draw else 1)
-			r1.append(new)
-
-		for p in losers:
-			po.setRating(avg_l[0][0])
-			po.setRd(p['deviation'])
-			po.update_player(*avg_w)
-			new = self._scale_changes(p, po.getRating() - avg_l[0][0], po.getRd() - p['deviation'], 0 if draw else -1)
-			r2.append(new)
-
-		return [r1, r2]
+		return [results[:len(winners)], results[len(winners):]]
 
 
 class TrueSkillRating(BaseRating):
@@ -285,6 +532,47 @@ class TrueSkillRating(BaseRating):
 			mu=self.init_rp, sigma=self.init_deviation,
 			beta=int(self.init_deviation/2), tau=int(self.init_deviation/100)
 		)
+		self.draw_margins = dict()  # {players count: draw margin}
+
+	def _draw_margin(self, size):
+		if (margin := self.draw_margins.get(size)) is None:
+			margin = self.draw_margins[size] = trueskill.calc_draw_margin(self.ts.draw_probability, size, env=self.ts)
+		return margin
+
+	def _changes_batch(self, rating, deviation, step, side, draw):
+		""" Closed form of the two teams TrueSkill factor graph """
+		steps = step[-1] + 1
+		sigma2 = deviation ** 2 + self.ts.tau ** 2
+		c2 = np.bincount(step, weights=sigma2 + self.ts.beta ** 2, minlength=steps)
+		c = np.sqrt(c2)
+		mu = np.bincount(step * 2 + side, weights=rating, minlength=steps * 2).reshape(steps, 2)
+		sizes = np.bincount(step, minlength=steps)
+		is_draw = np.zeros(steps, dtype=bool)
+		is_draw[step] = draw
+
+		diff = (mu[:, 0] - mu[:, 1]) / c
+		margin = np.array([self._draw_margin(size) for size in sizes.tolist()]) / c
+		v, w = np.zeros(steps), np.zeros(steps)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			if not is_draw.all():
+				x = diff - margin
+				denom = _cdf(x)
+				v_win = np.where(denom != 0, _pdf(x) / denom, -x)
+				v = np.where(is_draw, v, v_win)
+				w = np.where(is_draw, w, v_win * (v_win + x))
+			if is_draw.any():
+				a, b = margin - np.abs(diff), -margin - np.abs(diff)
+				denom = _cdf(a) - _cdf(b)
+				v_abs = np.where(denom != 0, (_pdf(b) - _pdf(a)) / denom, a)
+				v = np.where(is_draw, v_abs * np.where(diff < 0, -1, 1), v)
+				w = np.where(is_draw, v_abs ** 2 + (a * _pdf(a) - b * _pdf(b)) / denom, w)
+		# the trueskill module fails on the lost precision, leave such ratings unchanged instead
+		valid = (w > 0) & (w < 1)
+		v, w = np.where(valid, v, 0), np.where(valid, w, 0)
+
+		r_change = np.where(side == 0, 1, -1) * sigma2 / c[step] * v[step]
+		new_sigma = np.sqrt(sigma2 * (1 - sigma2 / c2[step] * w[step]))
+		return r_change, new_sigma - deviation
 
 	def rate(self, winners, losers, draw=False):
 		g1 = [self.ts.create_rating(mu=p['rating'], sigma=p['deviation']) for p in winners]
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Ratings recompute: replays the ranked matches history of a rating channel with the current rating system settings.
+
+Matches are streamed in chronological order and split into rating steps, one for each rated round, the same way as
+register_match_ranked() rates them. Steps without common players are grouped into batches, every batch is rated
+with a single vectorized rating_batch() call. The results are kept in memory and written by chunks at the end.
+
+Optional config.cfg variables:
+	RATING_REPLAY_CHUNK - amount of matches scheduled into batches at once.
+	RATING_REPLAY_SAVE_CHUNK - max rows updated or deleted by a single statement on save.
+"""
+import time
+import asyncio
+import numpy as np
+
+from core.config import cfg
+from core.database import db
+
+HISTORY_COLUMNS = (
+	'channel_id', 'user_id', 'at', 'rating_before', 'rating_change',
+	'deviation_before', 'deviation_change', 'match_id', 'reason'
+)
+PLAYERS_COLUMNS = (
+	'channel_id', 'user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak', 'last_ranked_at'
+)
+
+
+def match_results(winner, alpha_score, beta_score):
+	""" Return (wins, losses, draws) of the alpha team rated by register_match_ranked() """
+	if winner is None:
+		return 0, 0, 1
+	scores = [alpha_score or 0, beta_score or 0]
+	if not any(scores):  # matches registered without scores
+		scores[winner] = 1
+	return scores[0], scores[1], 0
+
+
+class RatingReplay:
+
+	def __init__(self, rating, channel_ids):
+		self.rating = rating
+		self.channel_ids = tuple(channel_ids)
+		self.chunk = getattr(cfg, 'RATING_REPLAY_CHUNK', 20000)
+		self.save_chunk = getattr(cfg, 'RATING_REPLAY_SAVE_CHUNK', 5000)
+
+		self.index = dict()  # {user_id: player index}
+		self.user_ids = []
+		self.nicks = []
+		# players state by index, the arrays grow on demand
+		self.state = dict(
+			rating=np.empty(0), deviation=np.empty(0), streak=np.empty(0, dtype=np.int64),
+			wins=np.empty(0, dtype=np.int64), losses=np.empty(0, dtype=np.int64), draws=np.empty(0, dtype=np.int64),
+			last_at=np.empty(0, dtype=np.int64)
+		)
+
+		self.match_ids = []
+		self.match_at = []
+		self.match_queues = []
+		self.history = []  # [{match, player, rating_before, rating_change, deviation_before, deviation_change}]
+
+		self.last = None  # (at, match_id) of the last replayed match
+		self.rows = 0  # streamed matches players rows
+		self.steps = 0
+		self.batches = 0
+		self.elapsed = 0.0
+
+	@property
+	def matches(self):
+		return len(self.match_ids)
+
+	def _grow(self):
+		size = max(1024, len(self.user_ids) * 2)
+		init = dict(rating=self.rating.init_rp, deviation=self.rating.init_deviation, last_at=-1)
+		for key, arr in self.state.items():
+			self.state[key] = np.concatenate((arr, np.full(size - len(arr), init.get(key, 0), dtype=arr.dtype)))
+
+	def _player(self, user_id, nick):
+		if (idx := self.index.get(user_id)) is not None:
+			self.nicks[idx] = nick
+			return idx
+
+		idx = self.index[user_id] = len(self.user_ids)
+		self.user_ids.append(user_id)
+		self.nicks.append(nick)
+		if idx >= len(self.state['rating']):
+			self._grow()
+		return idx
+
+	def _query(self, columns, after):
+		""" Build the ranked matches players rows query, after or up to the last replayed match """
+		query = " ".join((
+			f"SELECT {columns}",
+			"FROM `qc_matches` AS m JOIN `qc_player_matches` AS pm ON pm.match_id=m.match_id",
+			"WHERE m.channel_id IN ({}) AND m.ranked=1 AND pm.team IS NOT NULL".format(
+				", ".join(("%s" for i in self.channel_ids))
+			),
+			"" if not self.last else
+			"AND (m.at > %s OR (m.at = %s AND m.match_id > %s))" if after else
+			"AND (m.at < %s OR (m.at = %s AND m.match_id <= %s))"
+		))
+		return query, self.channel_ids + ((self.last[0], self.last[0], self.last[1]) if self.last else ())
+
+	async def changed(self):
+		""" Check if any of the replayed matches rows were deleted (undone matches, stats resets) since the replay """
+		if not self.last:
+			return False
+		query, args = self._query("COUNT(*) AS `count`", after=False)
+		return (await db.fetchone(query, args))['count'] != self.rows
+
+	async def _stream(self):
+		""" Yield (match_id, at, queue_name, winner, alpha_score, beta_score, [team rows, team rows]) of the matches """
+		query, args = self._query(
+			"m.match_id, m.at, m.queue_name, m.winner, m.alpha_score, m.beta_score, pm.user_id, pm.nick, pm.team", after=True
+		)
+		query += " ORDER BY m.at, m.match_id, pm.team, pm.user_id"
+
+		match = None
+		async for rows in db.stream(query, args):
+			self.rows += len(rows)
+			for row in rows:
+				if match is None or match[0] != row['match_id']:
+					if match is not None:
+						yield match
+					match = (
+						row['match_id'], row['at'], row['queue_name'], row['winner'],
+						row['alpha_score'], row['beta_score'], ([], [])
+					)
+				match[6][row['team']].append((row['user_id'], row['nick']))
+		if match is not None:
+			yield match
+
+	async def replay(self, progress=None, interval=10):
+		""" Replay the matches registered after the last replayed one, await progress(self) every interval seconds """
+		loop = asyncio.get_running_loop()
+		reported_at = time.monotonic()
+		matches = []
+		async for match in self._stream():
+			matches.append(match)
+			if len(matches) >= self.chunk:
+				# the computations do not share any data with the event loop, keep it responsive
+				await loop.run_in_executor(None, self._process, matches)
+				matches = []
+				if progress and time.monotonic() - reported_at > interval:
+					reported_at = time.monotonic()
+					await progress(self)
+		if len(matches):
+			await loop.run_in_executor(None, self._process, matches)
+
+	def _process(self, matches):
+		at = time.perf_counter()
+		first_match = len(self.match_ids)
+
+		# split the matches into rating steps
+		rows_player, rows_step, rows_side, rows_draw = [], [], [], []
+		step_rows = []  # (first row, last row + 1) of each step
+		step_noop = []
+		step_first = []
+		first_rows, last_rows = [], []  # step rows of each match player on its first and last rounds
+		hist_match = []
+
+		for match_id, match_at, queue_name, winner, alpha_score, beta_score, teams in matches:
+			if not all(teams):
+				continue
+			n = len(self.match_ids)
+			self.match_ids.append(match_id)
+			self.match_at.append(match_at)
+			self.match_queues.append(queue_name)
+			players = [[self._player(*p) for p in team] for team in teams]
+
+			rounds = list(self.rating.series_rounds(*match_results(winner, alpha_score, beta_score)))
+			noop = not len(rounds)
+			for k, round_winner in enumerate(rounds or [None]):
+				start = len(rows_player)
+				for team in (0, 1):
+					rows_player.extend(players[team])
+					rows_side.extend([team if round_winner is None else int(round_winner != team)] * len(players[team]))
+				size = len(rows_player) - start
+				rows_step.extend([len(step_rows)] * size)
+				rows_draw.extend([round_winner is None] * size)
+				step_rows.append((start, start + size))
+				step_noop.append(noop)
+				step_first.append(k == 0)
+				if k == 0:
+					first_rows.extend(range(start, start + size))
+					hist_match.extend([n] * size)
+			last_rows.extend(range(start, start + size))
+
+		self.last = (matches[-1][1], matches[-1][0])
+		if not len(step_rows):
+			return
+
+		rows_player = np.array(rows_player, dtype=np.int64)
+		rows_step = np.array(rows_step, dtype=np.int64)
+		rows_side = np.array(rows_side, dtype=np.int64)
+		rows_draw = np.array(rows_draw, dtype=bool)
+		rows_noop = np.array(step_noop, dtype=bool)[rows_step]
+		rows_first = np.array(step_first, dtype=bool)[rows_step]
+
+		# schedule the steps, each step goes to the batch after the last batch of its players
+		step_level = []
+		player_level = [0] * len(self.user_ids)
+		players = rows_player.tolist()
+		for start, end in step_rows:
+			level = 1 + max(map(player_level.__getitem__, players[start:end]))
+			step_level.append(level)
+			for p in players[start:end]:
+				player_level[p] = level
+
+		rows_level = np.array(step_level, dtype=np.int64)[rows_step]
+		order = np.argsort(rows_level, kind='stable')  # keeps the steps rows together
+		bounds = np.flatnonzero(np.diff(rows_level[order])) + 1
+
+		state = self.state
+		before_r, before_d = np.empty(len(rows_player)), np.empty(len(rows_player))
+		after_r, after_d = np.empty(len(rows_player)), np.empty(len(rows_player))
+		for idx in np.split(order, bounds):
+			p = rows_player[idx]
+			before_r[idx] = state['rating'][p]
+			# deviations are limited when the players are fetched for a match, not between its rounds
+			before_d[idx] = np.where(
+				rows_first[idx], np.minimum(state['deviation'][p], self.rating.init_deviation), state['deviation'][p]
+			)
+			after_r[idx], after_d[idx] = before_r[idx], before_d[idx]
+
+			if (idx := idx[~rows_noop[idx]]).size == 0:
+				continue
+			p = rows_player[idx]
+			step = rows_step[idx]
+			step = np.concatenate(([0], np.cumsum(np.diff(step) != 0)))
+			after_r[idx], after_d[idx], state['streak'][p] = self.rating.rate_batch(
+				before_r[idx], before_d[idx], state['streak'][p], step, rows_side[idx], rows_draw[idx]
+			)
+			state['rating'][p], state['deviation'][p] = after_r[idx], after_d[idx]
+			score = np.where(rows_draw[idx], 0, 1 - rows_side[idx] * 2)
+			state['wins'][p] += score == 1
+			state['losses'][p] += score == -1
+			state['draws'][p] += score == 0
+			self.batches += 1
+
+		first_rows, last_rows = np.array(first_rows, dtype=np.int64), np.array(last_rows, dtype=np.int64)
+		hist_match = np.array(hist_match, dtype=np.int32)
+		hist_player = rows_player[first_rows].astype(np.int32)
+		np.maximum.at(state['last_at'], hist_player, np.array(self.match_at[first_match:], dtype=np.int64)[
+			hist_match - first_match
+		])
+		self.history.append(dict(
+			match=hist_match,
+			player=hist_player,
+			rating_before=before_r[first_rows].astype(np.int32),
+			rating_change=(after_r[last_rows] - before_r[first_rows]).astype(np.int32),
+			deviation_before=before_d[first_rows].astype(np.int32),
+			deviation_change=(after_d[last_rows] - before_d[first_rows]).astype(np.int32)
+		))
+
+		self.steps += len(step_rows)
+		self.elapsed += time.perf_counter() - at
+
+	def _history_rows(self):
+		channel_id = self.rating.channel_id
+		for h in self.history:
+			match = h['match'].tolist()
+			yield from zip(
+				(channel_id for i in match),
+				(self.user_ids[i] for i in h['player'].tolist()),
+				(self.match_at[i] for i in match),
+				h['rating_before'].tolist(),
+				h['rating_change'].tolist(),
+				h['deviation_before'].tolist(),
+				h['deviation_change'].tolist(),
+				(self.match_ids[i] for i in match),
+				(self.match_queues[i] for i in match)
+			)
+
+	def _players_rows(self):
+		channel_id = self.rating.channel_id
+		size = len(self.user_ids)
+		state = {key: arr[:size].tolist() for key, arr in self.state.items()}
+		return zip(
+			(channel_id for i in range(size)), self.user_ids, self.nicks,
+			state['rating'], state['deviation'], state['wins'], state['losses'], state['draws'], state['streak'],
+			(at if at >= 0 else None for at in state['last_at'])
+		)
+
+	async def save(self):
+		"""
+		Replace the rating channel players ratings and rating history. The rows are written by statements of bounded
+		size, so the tables are not locked for long: the new history is inserted before the old one is deleted.
+		An interrupted save leaves mixed data, the recompute should be run again then.
+		"""
+		channel_id = self.rating.channel_id
+		last_id = (await db.fetchone(
+			"SELECT MAX(`id`) AS `id` FROM `qc_rating_history` WHERE `channel_id`=%s", (channel_id, )
+		))['id']
+		await db.insert_many('qc_rating_history', self._history_rows(), columns=HISTORY_COLUMNS)
+		await db.insert_many(
+			'qc_players', self._players_rows(), columns=PLAYERS_COLUMNS,
+			on_dublicate='update', update=PLAYERS_COLUMNS[3:]
+		)
+
+		# players without any replayed matches
+		stale = [
+			row['user_id'] for row in
+			await db.fetchall("SELECT `user_id` FROM `qc_players` WHERE `channel_id`=%s", (channel_id, ))
+			if row['user_id'] not in self.index
+		]
+		for i in range(0, len(stale), self.save_chunk):
+			user_ids = stale[i:i + self.save_chunk]
+			await db.execute(
+				"UPDATE `qc_players` SET `rating`=NULL, `deviation`=NULL, `wins`=0, `losses`=0, `draws`=0, `streak`=0, " +
+				"`last_ranked_at`=NULL WHERE `channel_id`=%s AND `user_id` IN ({})".format(
+					", ".join(("%s" for i in user_ids))
+				), (channel_id, *user_ids)
+			)
+
+		if last_id is not None:
+			while await db.execute_rowcount(
+				"DELETE FROM `qc_rating_history` WHERE `channel_id`=%s AND `id`<=%s LIMIT %s",
+				(channel_id, last_id, self.save_chunk)
+			) >= self.save_chunk:
+				pass
+
+	def summary(self):
+		return "{matches} matches ({steps} rating steps in {batches} batches) of {players} players in {elapsed:.1f}s, " \
+			"{rate:.0f} matches/s".format(
+				matches=self.matches, steps=self.steps, batches=self.batches, players=len(self.user_ids),
+				elapsed=self.elapsed, rate=self.matches / max(self.elapsed, 0.001)
+			)
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 import time
+import json
 import datetime
 import asyncio
 import bot
+from core.config import cfg
 from core.console import log
 from core.database import db
-from core.utils import iter_to_dict, find, get_nick
+from core.utils import iter_to_dict, find, get_nick, TTLCache
+from core.executor import cpu_executor
+from bot.stats.replay import RatingReplay
 
 db.ensure_table(dict(
 	tname="players",
@@ -30,9 +34,11 @@ db.ensure_table(dict(
 		dict(cname="wins", ctype=db.types.int, notnull=True, default=0),
 		dict(cname="losses", ctype=db.types.int, notnull=True, default=0),
 		dict(cname="draws", ctype=db.types.int, notnull=True, default=0),
-		dict(cname="streak", ctype=db.types.int, notnull=True, default=0)
+		dict(cname="streak", ctype=db.types.int, notnull=True, default=0),
+		dict(cname="last_ranked_at", ctype=db.types.int)
 	],
-	primary_keys=["user_id", "channel_id"]
+	primary_keys=["user_id", "channel_id"],
+	indexes={"channel_id": ["channel_id"]}
 ))
 
 db.ensure_table(dict(
@@ -49,7 +55,8 @@ db.ensure_table(dict(
 		dict(cname="match_id", ctype=db.types.int),
 		dict(cname="reason", ctype=db.types.str)
 	],
-	primary_keys=["id"]
+	primary_keys=["id"],
+	indexes={"channel_user_at": ["channel_id", "user_id", "at"], "match_id": ["match_id"]}
 ))
 
 db.ensure_table(dict(
@@ -98,6 +105,104 @@ db.ensure_table(dict(
 	primary_keys=["guild_id"]
 ))
 
+# Daily matches count per queue for each player, user_id 0 holds the channel matches count
+db.ensure_table(dict(
+	tname="qc_activity",
+	columns=[
+		dict(cname="channel_id", ctype=db.types.int, notnull=True),
+		dict(cname="day", ctype=db.types.int, notnull=True),
+		dict(cname="user_id", ctype=db.types.int, notnull=True),
+		dict(cname="queue_name", ctype=db.types.str, notnull=True),
+		dict(cname="matches", ctype=db.types.int, notnull=True, default=0)
+	],
+	primary_keys=["channel_id", "day", "user_id", "queue_name"]
+))
+
+# Weekly rating decay progress, channel_id 0 holds the period of the last started decay job
+db.ensure_table(dict(
+	tname="rating_decays",
+	columns=[
+		dict(cname="channel_id", ctype=db.types.int),
+		dict(cname="decayed_at", ctype=db.types.int)
+	],
+	primary_keys=["channel_id"]
+))
+
+
+async def backfill_last_ranked_at():
+	await db.execute(
+		"UPDATE `qc_players` AS p JOIN (" +
+		"  SELECT h.channel_id, h.user_id, MAX(h.at) AS at FROM `qc_rating_history` AS h" +
+		"    WHERE h.match_id IS NOT NULL GROUP BY h.channel_id, h.user_id" +
+		") AS tmp ON p.channel_id=tmp.channel_id AND p.user_id=tmp.user_id " +
+		"SET p.last_ranked_at=tmp.at"
+	)
+
+
+db.add_migration('qc_players.last_ranked_at', backfill_last_ranked_at)
+
+rating_locks = dict()  # {rating channel_id: asyncio.Lock()}
+
+
+def rating_lock(channel_id):
+	""" Lock of a rating channel data, serializes the ranked matches results with the ratings recompute """
+	if (lock := rating_locks.get(channel_id)) is None:
+		lock = rating_locks[channel_id] = asyncio.Lock()
+	return lock
+
+
+stats_cache = TTLCache(ttl=getattr(cfg, 'STATS_CACHE_TTL', 60), size=getattr(cfg, 'STATS_CACHE_SIZE', 4096))
+
+
+async def update_activity(channel_id, at, queue_name, user_ids, delta=1, tx=None):
+	""" Add delta to the channel and players matches count of the match day """
+	day = at // 86400
+	rows = [(channel_id, day, 0, queue_name or "", delta)] + [(channel_id, day, i, queue_name or "", delta) for i in user_ids]
+	await (tx or db).execute(
+		"INSERT INTO `qc_activity` (`channel_id`, `day`, `user_id`, `queue_name`, `matches`) VALUES " +
+		", ".join(("(%s, %s, %s, %s, %s)" for i in rows)) +
+		" ON DUPLICATE KEY UPDATE `matches`=GREATEST(`matches`+VALUES(`matches`), 0)",
+		[i for row in rows for i in row]
+	)
+	stats_cache.invalidate(channel_id)
+
+
+async def rebuild_activity(channel_id=None, user_ids=None):
+	""" Recount the activity rollup from the matches tables, for all channels if channel_id is not specified """
+	where, args = [], []
+	if channel_id is not None:
+		where.append("{t}.channel_id=%s")
+		args.append(channel_id)
+	if user_ids is not None:
+		where.append("{t}.user_id IN (" + ", ".join(("%s" for i in user_ids)) + ")")
+		args.extend(user_ids)
+	where_sql = (" WHERE " + " AND ".join(where)) if len(where) else ""
+
+	await db.execute("DELETE a FROM `qc_activity` AS a" + where_sql.format(t="a"), args)
+	await db.execute(
+		"INSERT INTO `qc_activity` (`channel_id`, `day`, `user_id`, `queue_name`, `matches`) " +
+		"SELECT pm.channel_id, FLOOR(m.at/86400), pm.user_id, COALESCE(m.queue_name, ''), COUNT(*) " +
+		"FROM `qc_player_matches` AS pm JOIN `qc_matches` AS m ON pm.match_id=m.match_id" + where_sql.format(t="pm") +
+		" GROUP BY pm.channel_id, FLOOR(m.at/86400), pm.user_id, COALESCE(m.queue_name, '')",
+		args
+	)
+	if user_ids is None:  # the channel rows (user_id 0) were deleted too
+		await db.execute(
+			"INSERT INTO `qc_activity` (`channel_id`, `day`, `user_id`, `queue_name`, `matches`) " +
+			"SELECT m.channel_id, FLOOR(m.at/86400), 0, COALESCE(m.queue_name, ''), COUNT(*) " +
+			"FROM `qc_matches` AS m" + where_sql.format(t="m") +
+			" GROUP BY m.channel_id, FLOOR(m.at/86400), COALESCE(m.queue_name, '')",
+			args
+		)
+
+	if channel_id is not None:
+		stats_cache.invalidate(channel_id)
+	else:
+		stats_cache.clear()
+
+
+db.add_migration('qc_activity', rebuild_activity)
+
 
 async def check_match_id_counter():
 	"""
@@ -116,16 +221,18 @@ async def next_match():
 	""" Increase match_id counter, return current match_id """
 	counter = await db.select_one(('next_id',), 'qc_match_id_counter')
 	await db.update('qc_match_id_counter', dict(next_id=counter['next_id']+1))
-	log.debug(f"Current match_id is {counter['next_id']}")
+	log.debug("Current match_id is %s", counter['next_id'])
 	return counter['next_id']
 
 
 async def register_match_unranked(ctx, m):
+	now = int(time.time())
 	await db.insert('qc_matches', dict(
 		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
 		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
-		at=int(time.time()), ranked=0, winner=None, maps="\n".join(m.maps)
+		at=now, ranked=0, winner=None, maps="\n".join(m.maps)
 	))
+	await update_activity(m.qc.id, now, m.queue.name, [p.id for p in m.players])
 
 	await db.insert_many('qc_players', (
 		dict(channel_id=m.qc.id, user_id=p.id)
@@ -154,12 +261,14 @@ async def register_match_unranked(ctx, m):
 
 
 async def register_match_ranked(ctx, m):
+	now = int(time.time())
 	await db.insert('qc_matches', dict(
 		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
 		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
-		at=int(time.time()), ranked=1, winner=m.winner,
+		at=now, ranked=1, winner=m.winner,
 		alpha_score=m.scores[0], beta_score=m.scores[1], maps="\n".join(m.maps)
 	))
+	await update_activity(m.qc.id, now, m.queue.name, [p.id for p in m.players])
 
 	for channel_id in {m.qc.id, m.qc.rating.channel_id}:
 		await db.insert_many('qc_players', (
@@ -167,120 +276,225 @@ async def register_match_ranked(ctx, m):
 			for p in m.players
 		), on_dublicate="ignore")
 
-	results = [[
-		await m.qc.rating.get_players((p.id for p in m.teams[0])),
-		await m.qc.rating.get_players((p.id for p in m.teams[1])),
-	]]
-
-	if m.winner is None:  # draw
-		after = m.qc.rating.rate(winners=results[0][0], losers=results[0][1], draw=True)
-		results.append(after)
-	else:  # process actual scores
-		n = 0
-		while n < m.scores[0] or n < m.scores[1]:
-			if n < m.scores[0]:
-				after = m.qc.rating.rate(winners=results[-1][0], losers=results[-1][1], draw=False)
-				results.append(after)
-			if n < m.scores[1]:
-				after = m.qc.rating.rate(winners=results[-1][1], losers=results[-1][0], draw=False)
-				results.append(after[::-1])
-			n += 1
-
-	after = iter_to_dict((*results[-1][0], *results[-1][1]), key='user_id')
-	before = iter_to_dict((*results[0][0], *results[0][1]), key='user_id')
-
-	for p in m.players:
-		nick = get_nick(p)
-		team = 0 if p in m.teams[0] else 1
-
-		await db.update(
-			"qc_players",
-			dict(
-				nick=nick,
-				rating=after[p.id]['rating'],
-				deviation=after[p.id]['deviation'],
-				wins=after[p.id]['wins'],
-				losses=after[p.id]['losses'],
-				draws=after[p.id]['draws'],
-				streak=after[p.id]['streak']
-			),
-			keys=dict(channel_id=m.qc.rating.channel_id, user_id=p.id)
+	# the rating data may be shared with other channels and rewritten by a ratings recompute
+	async with rating_lock(m.qc.rating.channel_id):
+		alpha = await m.qc.rating.get_players((p.id for p in m.teams[0]))
+		beta = await m.qc.rating.get_players((p.id for p in m.teams[1]))
+		results = (0, 0, 1) if m.winner is None else (m.scores[0], m.scores[1], 0)
+		alpha_after, beta_after = await cpu_executor.run(
+			m.qc.rating.rate_series, alpha, beta, *results, cost=len(m.players) * max(1, m.scores[0] + m.scores[1])
 		)
 
-		await db.insert(
-			'qc_player_matches',
-			dict(match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=nick, team=team)
-		)
-		await db.insert('qc_rating_history', dict(
-			channel_id=m.qc.rating.channel_id,
-			user_id=p.id,
-			at=int(time.time()),
-			rating_before=before[p.id]['rating'],
-			rating_change=after[p.id]['rating']-before[p.id]['rating'],
-			deviation_before=before[p.id]['deviation'],
-			deviation_change=after[p.id]['deviation']-before[p.id]['deviation'],
-			match_id=m.id,
-			reason=m.queue.name
-		))
+		after = iter_to_dict((*alpha_after, *beta_after), key='user_id')
+		before = iter_to_dict((*alpha, *beta), key='user_id')
+
+		for p in m.players:
+			nick = get_nick(p)
+			team = 0 if p in m.teams[0] else 1
+
+			await db.update(
+				"qc_players",
+				dict(
+					nick=nick,
+					last_ranked_at=now,
+					rating=after[p.id]['rating'],
+					deviation=after[p.id]['deviation'],
+					wins=after[p.id]['wins'],
+					losses=after[p.id]['losses'],
+					draws=after[p.id]['draws'],
+					streak=after[p.id]['streak']
+				),
+				keys=dict(channel_id=m.qc.rating.channel_id, user_id=p.id)
+			)
+
+			await db.insert(
+				'qc_player_matches',
+				dict(match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=nick, team=team)
+			)
+			await db.insert('qc_rating_history', dict(
+				channel_id=m.qc.rating.channel_id,
+				user_id=p.id,
+				at=now,
+				rating_before=before[p.id]['rating'],
+				rating_change=after[p.id]['rating']-before[p.id]['rating'],
+				deviation_before=before[p.id]['deviation'],
+				deviation_change=after[p.id]['deviation']-before[p.id]['deviation'],
+				match_id=m.id,
+				reason=m.queue.name
+			))
 
 	await m.qc.update_rating_roles(*m.players)
 	await m.print_rating_results(ctx, before, after)
 
 
 async def undo_match(ctx, match_id):
-	match = await db.select_one(('ranked', 'winner'), 'qc_matches', where=dict(match_id=match_id, channel_id=ctx.qc.id))
+	match = await db.select_one(
+		('ranked', 'winner', 'at', 'queue_name'), 'qc_matches', where=dict(match_id=match_id, channel_id=ctx.qc.id)
+	)
 	if not match:
 		return False
 
-	if match['ranked']:
-		p_matches = await db.select(('user_id', 'team'), 'qc_player_matches', where=dict(match_id=match_id))
-		p_history = iter_to_dict(
-			await db.select(
-				('user_id', 'rating_change', 'deviation_change'), 'qc_rating_history', where=dict(match_id=match_id)
-			), key='user_id'
-		)
-		stats = iter_to_dict(
-			await ctx.qc.rating.get_players((p['user_id'] for p in p_matches)), key='user_id'
-		)
-
-		for p in p_matches:
-			new = stats[p['user_id']]
-			changes = p_history[p['user_id']]
+	rating = ctx.qc.rating
+	async with rating_lock(rating.channel_id), db.transaction() as tx:
+		user_ids = [p['user_id'] for p in await tx.fetchall(
+			"SELECT `user_id` FROM `qc_player_matches` WHERE `match_id`=%s", (match_id, )
+		)]
 
-			print(match['winner'])
+		if match['ranked']:
 			if match['winner'] is None:
-				new['draws'] = max((new['draws'] - 1, 0))
-			elif match['winner'] == p['team']:
-				new['wins'] = max((new['wins'] - 1, 0))
+				results_sql, results_args = "p.draws=GREATEST(p.draws-1, 0)", ()
 			else:
-				new['losses'] = max((new['losses'] - 1, 0))
-
-			new['rating'] = max((new['rating']-changes['rating_change'], 0))
-			new['deviation'] = max((new['deviation']-changes['deviation_change'], 0))
+				results_sql = ", ".join((
+					"p.wins=IF(pm.team=%s, GREATEST(p.wins-1, 0), p.wins)",
+					"p.losses=IF(pm.team=%s, p.losses, GREATEST(p.losses-1, 0))"
+				))
+				results_args = (match['winner'], match['winner'])
+
+			# restore ratings and results of all the match players at once
+			await tx.execute(
+				"UPDATE `qc_players` AS p " +
+				"JOIN `qc_player_matches` AS pm ON pm.user_id=p.user_id AND pm.match_id=%s " +
+				"JOIN `qc_rating_history` AS h ON h.user_id=p.user_id AND h.match_id=pm.match_id " +
+				"SET p.rating=GREATEST(COALESCE(p.rating, %s)-h.rating_change, 0), " +
+				"p.deviation=GREATEST(COALESCE(LEAST(p.deviation, %s), %s)-h.deviation_change, 0), " +
+				results_sql + " WHERE p.channel_id=%s",
+				(match_id, rating.init_rp, rating.init_deviation, rating.init_deviation, *results_args, rating.channel_id)
+			)
+			await tx.execute("DELETE FROM `qc_rating_history` WHERE `match_id`=%s", (match_id, ))
+			await tx.execute(
+				"UPDATE `qc_players` AS p " +
+				"JOIN `qc_player_matches` AS pm ON pm.user_id=p.user_id AND pm.match_id=%s " +
+				"LEFT JOIN (" +
+				"  SELECT h.user_id, MAX(h.at) AS at FROM `qc_player_matches` AS mp" +
+				"    JOIN `qc_rating_history` AS h ON h.channel_id=%s AND h.user_id=mp.user_id" +
+				"    WHERE mp.match_id=%s AND h.match_id IS NOT NULL GROUP BY h.user_id" +
+				") AS tmp ON tmp.user_id=p.user_id " +
+				"SET p.last_ranked_at=tmp.at WHERE p.channel_id=%s",
+				(match_id, rating.channel_id, match_id, rating.channel_id)
+			)
+
+		await tx.execute("DELETE FROM `qc_player_matches` WHERE `match_id`=%s", (match_id, ))
+		await tx.execute("DELETE FROM `qc_matches` WHERE `match_id`=%s", (match_id, ))
+		await update_activity(ctx.qc.id, match['at'], match['queue_name'], user_ids, delta=-1, tx=tx)
 
-			await db.update("qc_players", new, keys=dict(channel_id=ctx.qc.rating.channel_id, user_id=p['user_id']))
-		await db.delete("qc_rating_history", where=dict(match_id=match_id))
-		members = (ctx.channel.guild.get_member(p['user_id']) for p in p_matches)
+	if match['ranked']:
+		members = (ctx.channel.guild.get_member(user_id) for user_id in user_ids)
 		await ctx.qc.update_rating_roles(*(m for m in members if m is not None))
-
-	await db.delete('qc_player_matches', where=dict(match_id=match_id))
-	await db.delete('qc_matches', where=dict(match_id=match_id))
 	return True
 
 
-async def reset_channel(channel_id):
-	where = {'channel_id': channel_id}
-	await db.delete("qc_players", where=where)
-	await db.delete("qc_rating_history", where=where)
-	await db.delete("qc_matches", where=where)
-	await db.delete("qc_player_matches", where=where)
+# (table, chunks key) in deletion order, keys are the leading primary key columns
+RESET_TABLES = (
+	("qc_players", "user_id"),
+	("qc_rating_history", "id"),
+	("qc_matches", "match_id"),
+	("qc_player_matches", "match_id"),
+	("qc_activity", "day")
+)
 
 
-async def reset_player(channel_id, user_id):
-	where = {'channel_id': channel_id, 'user_id': user_id}
-	await db.delete("qc_players", where=where)
-	await db.delete("qc_rating_history", where=where)
-	await db.delete("qc_player_matches", where=where)
+async def delete_chunked(table, key, where):
+	"""
+	Delete rows matching the where dict by ranges of the key column, so every statement locks a bounded
+	amount of rows. Yields deleted rows count after every chunk.
+	Optional config.cfg variables:
+		STATS_RESET_CHUNK - max rows selected for a single delete statement.
+		STATS_RESET_PAUSE - seconds to sleep between the chunks.
+	"""
+	chunk = getattr(cfg, 'STATS_RESET_CHUNK', 5000)
+	pause = getattr(cfg, 'STATS_RESET_PAUSE', 0.1)
+	conditions = " AND ".join((f"`{column}`=%s" for column in where.keys()))
+	args = tuple(where.values())
+
+	last = None
+	while True:
+		rows = await db.fetchall(
+			f"SELECT `{key}` FROM `{table}` WHERE {conditions}" + (f" AND `{key}`>%s" if last is not None else "") +
+			f" ORDER BY `{key}` LIMIT {chunk}",
+			args + ((last, ) if last is not None else ())
+		)
+		if not len(rows):
+			return
+		last = rows[-1][key]
+		# the keys are not unique in some tables, count the deleted rows
+		yield await db.execute_rowcount(
+			f"DELETE FROM `{table}` WHERE {conditions} AND `{key}` BETWEEN %s AND %s",
+			args + (rows[0][key], last)
+		)
+		if len(rows) < chunk:
+			return
+		await asyncio.sleep(pause)
+
+
+async def _reset(channel_id, where, tables, progress=None):
+	""" Delete the stats rows table by table, await progress(deleted rows) every STATS_RESET_PROGRESS seconds """
+	interval = getattr(cfg, 'STATS_RESET_PROGRESS', 10)
+	deleted, reported_at = 0, time.monotonic()
+	try:
+		for table, key in tables:
+			async for count in delete_chunked(table, key, where):
+				deleted += count
+				if progress and time.monotonic() - reported_at > interval:
+					reported_at = time.monotonic()
+					await progress(deleted)
+	finally:
+		stats_cache.invalidate(channel_id)
+	return deleted
+
+
+async def reset_channel(channel_id, progress=None):
+	return await _reset(channel_id, {'channel_id': channel_id}, RESET_TABLES, progress)
+
+
+async def reset_player(channel_id, user_id, progress=None):
+	tables = [i for i in RESET_TABLES if i[0] != "qc_matches"]
+	return await _reset(channel_id, {'channel_id': channel_id, 'user_id': user_id}, tables, progress)
+
+
+async def rating_channel_ids(rating_channel_id):
+	""" Return ids of all the configured channels using the rating channel, including the ones not loaded """
+	rows = await db.select(['channel_id', 'cfg_data'], bot.QueueChannel.cfg_factory.table.name)
+	return [
+		row['channel_id'] for row in rows
+		if (json.loads(row['cfg_data']).get('rating_channel') or row['channel_id']) == rating_channel_id
+	]
+
+
+async def recompute_ratings(qc, progress=None, attempts=3):
+	"""
+	Replay all ranked matches of the channels using the qc rating channel with the qc rating settings,
+	then replace the players ratings and the rating history. Manual rating changes and decays are discarded.
+	The matches registered during the replay are caught up and the results are saved under the qc channel lock and
+	the rating channel lock, so only the ranked results of the other channels sharing the rating wait for it.
+	The replay is restarted if any of the replayed matches were deleted meanwhile.
+	"""
+	channels = [c for c in bot.queue_channels.values() if c.rating.channel_id == qc.rating.channel_id]
+	# channels not loaded by the bot do not register new matches, their history is replayed as well
+	unloaded = set(await rating_channel_ids(qc.rating.channel_id)) - set((c.id for c in channels))
+	if len(unloaded):
+		log.info(f"Ratings recompute of channel {qc.rating.channel_id} includes not loaded channels {sorted(unloaded)}.")
+
+	at = time.monotonic()
+	for attempt in range(attempts):
+		replay = RatingReplay(qc.rating, [*(c.id for c in channels), *unloaded])
+		await replay.replay(progress)
+
+		async def finish():
+			async with rating_lock(qc.rating.channel_id):
+				if await replay.changed():
+					return False
+				await replay.replay(progress)
+				await replay.save()
+				return True
+
+		if await qc.execute(finish()):
+			break
+		log.info(f"Matches history of channel {qc.rating.channel_id} changed during the ratings recompute, restarting.")
+	else:
+		raise bot.Exc.MatchStateError("The matches history keeps changing, try again later.")
+
+	log.info(f"Ratings of channel {qc.rating.channel_id} recomputed in {time.monotonic() - at:.1f}s: {replay.summary()}.")
+	return replay
 
 
 async def replace_player(channel_id, user_id1, user_id2, new_nick):
@@ -289,72 +503,142 @@ async def replace_player(channel_id, user_id1, user_id2, new_nick):
 	await db.update("qc_players", {'user_id': user_id2, 'nick': new_nick}, where)
 	await db.update("qc_rating_history", {'user_id': user_id2}, where)
 	await db.update("qc_player_matches", {'user_id': user_id2}, where)
+	await rebuild_activity(channel_id, [user_id1, user_id2])
 
 
 async def qc_stats(channel_id):
+	if (stats := stats_cache.get(channel_id, 'qc_stats')) is not None:
+		return stats
+
 	data = await db.fetchall(
-		"SELECT `queue_name`, COUNT(*) as count FROM `qc_matches` WHERE `channel_id`=%s " +
-		"GROUP BY `queue_name` ORDER BY count DESC",
+		"SELECT `queue_name`, CAST(SUM(`matches`) AS SIGNED) as count FROM `qc_activity` WHERE `channel_id`=%s AND `user_id`=0 " +
+		"GROUP BY `queue_name` HAVING count > 0 ORDER BY count DESC",
 		(channel_id,)
 	)
 	stats = dict(total=sum((i['count'] for i in data)))
 	stats['queues'] = data
+	stats_cache.set(channel_id, 'qc_stats', stats)
 	return stats
 
 
 async def user_stats(channel_id, user_id):
+	if (stats := stats_cache.get(channel_id, ('user_stats', user_id))) is not None:
+		return stats
+
 	data = await db.fetchall(
-		"SELECT `queue_name`, COUNT(*) as count FROM `qc_player_matches` AS pm " +
-		"JOIN `qc_matches` AS m ON pm.match_id=m.match_id " +
-		"WHERE pm.channel_id=%s AND user_id=%s " +
-		"GROUP BY m.queue_name ORDER BY count DESC",
+		"SELECT `queue_name`, CAST(SUM(`matches`) AS SIGNED) as count FROM `qc_activity` WHERE `channel_id`=%s AND `user_id`=%s " +
+		"GROUP BY `queue_name` HAVING count > 0 ORDER BY count DESC",
 		(channel_id, user_id)
 	)
 	stats = dict(total=sum((i['count'] for i in data)))
 	stats['queues'] = data
+	stats_cache.set(channel_id, ('user_stats', user_id), stats)
 	return stats
 
 
 async def top(channel_id, time_gap=None):
+	""" Top players by matches played since the day of the time_gap timestamp """
+	since_day = time_gap // 86400 if time_gap else 0
+	if (stats := stats_cache.get(channel_id, ('top', since_day))) is not None:
+		return stats
+
 	total = await db.fetchone(
-		"SELECT COUNT(*) as count FROM `qc_matches` WHERE channel_id=%s" + (f" AND at>{time_gap} " if time_gap else ""),
-		(channel_id, )
+		"SELECT CAST(COALESCE(SUM(`matches`), 0) AS SIGNED) as count FROM `qc_activity` " +
+		"WHERE `channel_id`=%s AND `user_id`=0 AND `day`>=%s",
+		(channel_id, since_day)
 	)
 
 	data = await db.fetchall(
-		"SELECT p.nick as nick, COUNT(*) as count FROM `qc_player_matches` AS pm " +
-		"JOIN `qc_players` AS p ON pm.user_id=p.user_id AND pm.channel_id=p.channel_id " +
-		"JOIN `qc_matches` AS m ON pm.match_id=m.match_id " +
-		"WHERE pm.channel_id=%s " +
-		(f"AND m.at>{time_gap} " if time_gap else "") +
-		"GROUP BY p.user_id ORDER BY count DESC LIMIT 10",
-		(channel_id, )
+		"SELECT p.nick as nick, a.count as count FROM (" +
+		"  SELECT `user_id`, CAST(SUM(`matches`) AS SIGNED) as count FROM `qc_activity`" +
+		"    WHERE `channel_id`=%s AND `user_id`!=0 AND `day`>=%s" +
+		"    GROUP BY `user_id` HAVING count > 0 ORDER BY count DESC LIMIT 10" +
+		") AS a JOIN `qc_players` AS p ON p.user_id=a.user_id AND p.channel_id=%s " +
+		"ORDER BY a.count DESC",
+		(channel_id, since_day, channel_id)
 	)
 	stats = dict(total=total['count'])
 	stats['players'] = data
+	stats_cache.set(channel_id, ('top', since_day), stats)
 	return stats
 
 
+async def match_history(channel_id, before=None, limit=10, match_id=None, queue_id=None, user_id=None, ranked=None):
+	"""
+	Return a page of the channel matches, newest first, each match has a 'players' list.
+	Pages are keyset-paginated: pass the returned 'next' match_id as `before` to get the next page.
+	"""
+	where, args = ["m.channel_id=%s"], [channel_id]
+	join = ""
+	if user_id is not None:
+		join = " JOIN `qc_player_matches` AS f ON f.match_id=m.match_id AND f.user_id=%s"
+		args.insert(0, user_id)
+	for column, value in (('match_id', match_id), ('queue_id', queue_id), ('ranked', ranked)):
+		if value is not None:
+			where.append(f"m.{column}=%s")
+			args.append(value)
+	if before is not None:
+		where.append("m.match_id<%s")
+		args.append(before)
+
+	rows = await db.fetchall(
+		"SELECT m.*, pm.user_id, pm.nick, pm.team FROM (" +
+		"  SELECT m.* FROM `qc_matches` AS m" + join +
+		"    WHERE " + " AND ".join(where) +
+		"    ORDER BY m.match_id DESC LIMIT %s" +
+		") AS m LEFT JOIN `qc_player_matches` AS pm ON pm.match_id=m.match_id " +
+		"ORDER BY m.match_id DESC",
+		(*args, limit + 1)
+	)
+
+	matches = dict()  # {match_id: match}
+	for row in rows:
+		if (match := matches.get(row['match_id'])) is None:
+			match = matches[row['match_id']] = {
+				k: v for k, v in row.items() if k not in ('user_id', 'nick', 'team')
+			}
+			match['players'] = []
+		if row['user_id'] is not None:
+			match['players'].append(dict(user_id=row['user_id'], nick=row['nick'], team=row['team']))
+
+	matches = list(matches.values())
+	return dict(
+		matches=matches[:limit],
+		next=matches[limit-1]['match_id'] if len(matches) > limit else None
+	)
+
+
 async def last_games(channel_id):
 	#  get last played ranked match for all players
-	data = await db.fetchall(
-		"SELECT tmp.at, p.* " +
-		"FROM `qc_players` AS p " +
-		"LEFT JOIN (" +
-		"  SELECT MAX(h.at) AS at, h.user_id FROM `qc_rating_history` AS h" +
-		"    WHERE h.channel_id=%s AND h.match_id IS NOT NULL" +
-		"    GROUP BY h.user_id" +
-		") AS tmp ON p.user_id=tmp.user_id " +
-		"WHERE p.channel_id=%s",
-		(channel_id, channel_id)
+	data = await db.select(
+		('last_ranked_at AS at', 'user_id', 'rating', 'deviation'), 'qc_players', where=dict(channel_id=channel_id)
 	)
 	return data
 
 
 class StatsJobs:
+	"""
+	Weekly rating decays, processed by a bounded pool of workers.
+	Optional config.cfg variables:
+		RATING_DECAY_CONCURRENCY - amount of channels decayed at the same time.
+		RATING_DECAY_DB_BUDGET - max fraction of time each worker spends decaying, the rest it sleeps.
+	"""
 
 	def __init__(self):
 		self.next_decay_at = int(self.next_monday().timestamp())
+		self.concurrency = getattr(cfg, 'RATING_DECAY_CONCURRENCY', 4)
+		self.db_budget = getattr(cfg, 'RATING_DECAY_DB_BUDGET', 0.5)
+		self.decay_task = None
+		self.queued_decay = None  # period to decay after the running decays job
+		self.resume_checked = False
+		self.channel_tasks = dict()  # {channel_id: stats reset or ratings recompute task}
+
+	def start_job(self, channel_id, coro):
+		""" Run a stats reset or ratings recompute coroutine in the background, one per channel at a time """
+		if (task := self.channel_tasks.get(channel_id)) is not None and not task.done():
+			coro.close()
+			raise bot.Exc.MatchStateError("Another stats job is already in progress on this channel.")
+		self.channel_tasks[channel_id] = asyncio.create_task(coro)
 
 	@staticmethod
 	def next_monday():
@@ -364,23 +648,88 @@ class StatsJobs:
 			d += datetime.timedelta(days=1)
 		return d
 
+	@staticmethod
+	def last_monday():
+		d = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+		return d - datetime.timedelta(days=d.weekday())
+
 	@staticmethod
 	def tomorrow():
 		d = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
 		d += datetime.timedelta(days=1)
 		return d
 
-	@staticmethod
-	async def apply_rating_decays():
-		log.info("--- Applying weekly deviation decays ---")
+	async def resume_rating_decays(self):
+		""" Continue the current week decay job if it was interrupted """
+		period = int(self.last_monday().timestamp())
+		job = await db.select_one(('decayed_at',), 'rating_decays', where=dict(channel_id=0))
+		if job and job['decayed_at'] == period:
+			self.start_rating_decays(period)
+
+	def start_rating_decays(self, period):
+		if self.decay_task is None or self.decay_task.done():
+			self.decay_task = asyncio.create_task(self.apply_rating_decays(period))
+		elif period != self.queued_decay:
+			log.info(f"Weekly decays of the previous week are still in progress, the decays of {period} are queued.")
+			self.queued_decay = period
+
+	async def apply_rating_decays(self, period):
+		await db.insert('rating_decays', dict(channel_id=0, decayed_at=period), on_dublicate='replace')
+		done = set((
+			row['channel_id'] for row in
+			await db.fetchall("SELECT `channel_id` FROM `rating_decays` WHERE `decayed_at` >= %s", (period, ))
+		))
+		pending = asyncio.Queue()
 		for qc in bot.queue_channels.values():
-			await qc.apply_rating_decay()
-			await asyncio.sleep(1)
+			if qc.id not in done:
+				pending.put_nowait(qc)
+		total = pending.qsize()
+		if not total:
+			return
+
+		log.info(f"--- Applying weekly deviation decays ({total} channels left) ---")
+		progress = dict(done=0, reported_at=time.monotonic())
+
+		async def decay(qc):
+			# the channel is marked as decayed in the same transaction, so it never gets decayed twice
+			async with db.transaction() as tx:
+				await qc.apply_rating_decay(tx=tx)
+				await tx.insert_many(
+					'rating_decays', [dict(channel_id=qc.id, decayed_at=period)], on_dublicate='replace'
+				)
+
+		async def worker():
+			while not pending.empty():
+				qc = pending.get_nowait()
+				at = time.monotonic()
+				try:
+					await qc.execute(decay(qc))
+				except Exception as e:
+					log.error(f"Failed to apply rating decay on channel {qc.id}: {str(e)}")
+
+				progress['done'] += 1
+				if time.monotonic() - progress['reported_at'] > 60:
+					progress['reported_at'] = time.monotonic()
+					log.info(f"Weekly decays progress: {progress['done']}/{total} channels.")
+
+				if self.db_budget < 1:
+					await asyncio.sleep((time.monotonic() - at) * (1 / max(self.db_budget, 0.01) - 1))
+
+		await asyncio.gather(*(worker() for i in range(max(1, min(self.concurrency, total)))))
+		log.info(f"--- Weekly deviation decays applied on {progress['done']} channels ---")
 
 	async def think(self, frame_time):
+		if not self.resume_checked and bot.bot_ready:
+			self.resume_checked = True
+			await self.resume_rating_decays()
+
 		if frame_time > self.next_decay_at:
-			self.next_decay_at = int(self.next_monday().timestamp())
-			asyncio.create_task(self.apply_rating_decays())
+			period, self.next_decay_at = self.next_decay_at, int(self.next_monday().timestamp())
+			self.start_rating_decays(period)
+
+		if self.queued_decay is not None and self.decay_task.done():
+			period, self.queued_decay = self.queued_decay, None
+			self.start_rating_decays(period)
 
 
 jobs = StatsJobs()
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import json
+import hashlib
+from itertools import chain
+from contextlib import asynccontextmanager
 import aiomysql
 from pymysql import err as mysqlErr
 from .common import *
 
+from core.config import cfg
 from core.console import log
+from core.metrics import db_query_seconds
 
 
 class Types:
@@ -22,11 +28,35 @@ reference_options = dict(
 	SET_DEFAULT='SET DEFAULT'
 )
 
-table_blank = dict(tname=None, columns=[], primary_keys=[], foreign_keys=[])
+table_blank = dict(tname=None, columns=[], primary_keys=[], foreign_keys=[], indexes={})  # indexes: {name: [columns]}
 column_blank = dict(cname=None, ctype=Types.str, notnull=False, unique=False, autoincrement=False, default=None)
 fkey_blank = dict(cname=None, refTable=None, refColumn=None, on_delete=None, on_update=None)
 
 
+class Transaction:
+	""" Executes statements on a single connection within a transaction """
+
+	def __init__(self, adapter, conn, cur):
+		self.adapter = adapter
+		self.conn = conn
+		self.cur = cur
+
+	async def execute(self, *args):
+		try:
+			with db_query_seconds.time(statement=self.adapter._statement(args[0])):
+				await self.cur.execute(*args)
+			return self.cur.lastrowid
+		except mysqlErr.Error as e:
+			self.adapter.wrap_exc(e)
+
+	async def fetchall(self, *args):
+		await self.execute(*args)
+		return await self.cur.fetchall()
+
+	async def insert_many(self, table, it, on_dublicate=None, update=None, columns=None):
+		await self.adapter._insert_many(self.conn, self.cur, table, it, on_dublicate, update, columns)
+
+
 class Adapter:
 	types = Types
 	errors = Errors
@@ -45,54 +75,96 @@ class Adapter:
 		except Exception:
 			raise(ValueError('Bad database address string: ' + self.dbAddress))
 
-		try:
-			self.pool = self.loop.run_until_complete(aiomysql.create_pool(
-				host=self.dbHost,
-				user=self.dbUser,
-				password=self.dbPassword,
-				db=self.dbName,
-				charset='utf8mb4',
-				autocommit=True,
-				cursorclass=aiomysql.cursors.DictCursor))
-
-		except mysqlErr.Error as e:
-			self.wrap_exc(e)
+		self.pool = None
+		self.tables = dict()  # {tname: table} - tables registered by ensure_table()
+		self.checks = []  # coroutine functions to run after the migration
+		self.migrations = dict()  # {name: coroutine function} - one-time data migrations
+		self.insert_rows = getattr(cfg, 'DB_INSERT_ROWS', 1000)
+		self.max_packet = None
+
+	async def connect(self):
+		""" Return the connections pool, create it on first use """
+		if self.pool is None:
+			try:
+				self.pool = await aiomysql.create_pool(
+					host=self.dbHost,
+					user=self.dbUser,
+					password=self.dbPassword,
+					db=self.dbName,
+					charset='utf8mb4',
+					autocommit=True,
+					cursorclass=aiomysql.cursors.DictCursor)
+
+			except mysqlErr.Error as e:
+				self.wrap_exc(e)
+		return self.pool
 
 	async def execute(self, *args):
-		async with self.pool.acquire() as conn:
+		async with (await self.connect()).acquire() as conn:
 			async with conn.cursor() as cur:
 				try:
-					await cur.execute(*args)
+					with db_query_seconds.time(statement=self._statement(args[0])):
+						await cur.execute(*args)
 					return cur.lastrowid
 				except Exception as e:
 					self.wrap_exc(e)
 
+	async def execute_rowcount(self, *args):
+		""" Execute the statement and return the amount of affected rows """
+		async with (await self.connect()).acquire() as conn:
+			async with conn.cursor() as cur:
+				try:
+					with db_query_seconds.time(statement=self._statement(args[0])):
+						return await cur.execute(*args)
+				except Exception as e:
+					self.wrap_exc(e)
+
 	async def executemany(self, *args):
-		async with self.pool.acquire() as conn:
+		async with (await self.connect()).acquire() as conn:
 			async with conn.cursor() as cur:
 				try:
-					await cur.executemany(*args)
+					with db_query_seconds.time(statement=self._statement(args[0])):
+						await cur.executemany(*args)
 				except mysqlErr.Error as e:
 					self.wrap_exc(e)
 
 	async def fetchone(self, *args):
-		async with self.pool.acquire() as conn:
+		async with (await self.connect()).acquire() as conn:
 			async with conn.cursor() as cur:
 				try:
-					await cur.execute(*args)
+					with db_query_seconds.time(statement=self._statement(args[0])):
+						await cur.execute(*args)
 					return await cur.fetchone()
 				except mysqlErr.Error as e:
 					self.wrap_exc(e)
 
 	async def fetchall(self, *args):
-		async with self.pool.acquire() as conn:
+		async with (await self.connect()).acquire() as conn:
 			async with conn.cursor() as cur:
 				try:
-					await cur.execute(*args)
+					with db_query_seconds.time(statement=self._statement(args[0])):
+						await cur.execute(*args)
 					return await cur.fetchall()
 				except mysqlErr.Error as e:
 					self.wrap_exc(e)
 
+	@asynccontextmanager
+	async def transaction(self):
+		""" Yield a Transaction, committed on exit or rolled back on exception """
+		async with (await self.connect()).acquire() as conn:
+			await conn.begin()
+			try:
+				async with conn.cursor() as cur:
+					yield Transaction(self, conn, cur)
+				await conn.commit()
+			except BaseException:
+				await conn.rollback()
+				raise
+
+	@staticmethod
+	def _statement(query):
+		return query.lstrip().split(None, 1)[0].upper()
+
 	@staticmethod
 	def _mysql_column(kwargs):
 		return "`{cname}` {ctype}{notnull}{unique}{autoincrement}{default}".format(
@@ -114,6 +186,10 @@ class Adapter:
 			on_update=" ON UPDATE " + reference_options[kwargs['on_update']] if kwargs['on_update'] else ''
 		)
 
+	@staticmethod
+	def _mysql_index(name, columns):
+		return "KEY `{}` ({})".format(name, ", ".join(("`{}`".format(c) for c in columns)))
+
 	@staticmethod
 	def _mysql_insert(columns, table, on_dublicate):
 		return "{action}{ignore} INTO {table} ({columns}) VALUES({values})".format(
@@ -138,26 +214,78 @@ class Adapter:
 
 		columns = [self._mysql_column({**column_blank, **col}) for col in table['columns']]
 		fkeys = ["FOREIGN KEY " + self._mysql_fkey({**fkey_blank, **fkey}) for fkey in table['foreign_keys']]
+		keys = [self._mysql_index(name, cols) for name, cols in table['indexes'].items()]
 		pkeys = ", PRIMARY KEY(" + ", ".join(table['primary_keys']) + ')' if len(table['primary_keys']) else ''
 
 		request = "CREATE TABLE {tname} ({tdeskr})".format(
 			tname=table['tname'],
-			tdeskr=", ".join((columns + fkeys)) + pkeys
+			tdeskr=", ".join((columns + fkeys + keys)) + pkeys
 		)
 
 		await self.execute(request)
 
 	def ensure_table(self, table):
-		self.loop.run_until_complete(self._ensure_table(table))
-
-	async def _ensure_table(self, table):
-		table = {**table_blank, **table}
-		columns = await self.fetchall("\n".join((
-			"SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS",
-			"WHERE TABLE_NAME = '{}' AND TABLE_SCHEMA = '{}'".format(table['tname'], self.dbName)
+		""" Register the table to be created or updated on migrate() """
+		self.tables[table['tname']] = {**table_blank, **table}
+
+	def add_check(self, coro):
+		""" Register a coroutine function to run after the migration """
+		self.checks.append(coro)
+
+	def add_migration(self, name, coro):
+		""" Register a coroutine function to run once after the tables are created or updated """
+		self.migrations[name] = coro
+
+	def _schema_fingerprint(self):
+		return hashlib.sha1(json.dumps(
+			[self.tables[tname] for tname in sorted(self.tables.keys())], sort_keys=True, default=str
+		).encode()).hexdigest()
+
+	async def migrate(self):
+		""" Create or update all registered tables, skip the schema check if the tables definitions are unchanged """
+		await self.execute("\n".join((
+			"CREATE TABLE IF NOT EXISTS `db_schema` (",
+			"`name` VARCHAR(191) NOT NULL, `fingerprint` VARCHAR(64), PRIMARY KEY(`name`))"
 		)))
-		columns = {i['COLUMN_NAME']: i['DATA_TYPE'] for i in columns}
-
+		fingerprint = self._schema_fingerprint()
+		row = await self.fetchone("SELECT `fingerprint` FROM `db_schema` WHERE `name`=%s", ['tables'])
+
+		if row is None or row['fingerprint'] != fingerprint:
+			log.info("Checking the database schema...")
+			schema = dict()  # {tname: {cname: data_type}}
+			for i in await self.fetchall(
+				"SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = %s",
+				[self.dbName]
+			):
+				schema.setdefault(i['TABLE_NAME'], dict())[i['COLUMN_NAME']] = i['DATA_TYPE']
+			indexes = dict()  # {tname: set(index names)}
+			for i in await self.fetchall(
+				"SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS WHERE TABLE_SCHEMA = %s",
+				[self.dbName]
+			):
+				indexes.setdefault(i['TABLE_NAME'], set()).add(i['INDEX_NAME'])
+
+			for table in self.tables.values():
+				await self._ensure_table(table, schema.get(table['tname'], dict()), indexes.get(table['tname'], set()))
+
+			await self.execute(
+				"REPLACE INTO `db_schema` (`name`, `fingerprint`) VALUES (%s, %s)", ['tables', fingerprint]
+			)
+
+		if len(self.migrations):
+			applied = set((row['name'] for row in await self.fetchall("SELECT `name` FROM `db_schema`")))
+			for name, coro in self.migrations.items():
+				if "migration:" + name not in applied:
+					log.info(f"Running database migration '{name}'...")
+					await coro()
+					await self.execute(
+						"INSERT INTO `db_schema` (`name`, `fingerprint`) VALUES (%s, %s)", ["migration:" + name, "applied"]
+					)
+
+		for coro in self.checks:
+			await coro()
+
+	async def _ensure_table(self, table, columns, indexes):
 		# Create table if not exist
 		if not len(columns):
 			await self.create_table(table)
@@ -182,6 +310,15 @@ class Adapter:
 					"Column '{}' types are mismatching, {} and {}".format(col['cname'], col['ctype'], columns[col['cname']])
 				))
 
+		# Create secondary indexes if not exist
+		for name, cols in table['indexes'].items():
+			if name not in indexes:
+				log.info(f"Adding index {name} to table {table['tname']}...")
+				await self.execute("ALTER TABLE {tname} ADD {index_sql}".format(
+					tname=table['tname'],
+					index_sql=self._mysql_index(name, cols)
+				))
+
 	async def select(self, columns, table, where=None, order_by=None, order_asc=False, limit=None, one=False):
 		conditions = " WHERE " + " AND ".join(("`{}`=%s".format(k) for k in where.keys())) if where else ''
 		args = list(where.values()) if where else ()
@@ -223,18 +360,84 @@ class Adapter:
 		request = self._mysql_update(table, d.keys(), keys.keys())
 		await self.execute(request, list(d.values()) + list(keys.values()))
 
-	async def insert_many(self, table, it, on_dublicate=None):
+	async def _max_packet(self, conn):
+		if self.max_packet is None:
+			async with conn.cursor() as cur:
+				await cur.execute("SELECT @@max_allowed_packet AS max_packet")
+				self.max_packet = (await cur.fetchone())['max_packet']
+		return self.max_packet
+
+	async def insert_many(self, table, it, on_dublicate=None, update=None, columns=None):
+		"""
+		Insert rows from the iterator of dicts with multi-row INSERT statements.
+		If columns are specified the rows are sequences of values in the columns order instead.
+		Each statement is limited by DB_INSERT_ROWS rows and the server max_allowed_packet size.
+		on_dublicate='update' updates the listed update columns of the existing rows.
+		"""
+		async with (await self.connect()).acquire() as conn:
+			async with conn.cursor() as cur:
+				await self._insert_many(conn, cur, table, it, on_dublicate, update, columns)
+
+	async def _insert_many(self, conn, cur, table, it, on_dublicate=None, update=None, columns=None):
+		it = iter(it)
 		try:
-			first, it = peek(iter(it))
+			first = next(it)
 		except StopIteration:
 			return
 
-		request = self._mysql_insert(first.keys(), table, on_dublicate)
-		await self.executemany(request, (list(d.values()) for d in it))
+		if columns is None:
+			columns = list(first.keys())
+			values = lambda d: (d[c] for c in columns)
+		else:
+			values = iter
+		head = "{action}{ignore} INTO {table} ({columns}) VALUES ".format(
+			action="REPLACE" if on_dublicate == 'replace' else "INSERT",
+			ignore=" IGNORE" if on_dublicate == 'ignore' else "",
+			table=table,
+			columns=", ".join((f"`{i}`" for i in columns))
+		)
+		tail = " ON DUPLICATE KEY UPDATE " + ", ".join(
+			(f"`{i}`=VALUES(`{i}`)" for i in update)
+		) if on_dublicate == 'update' else ""
+
+		# leave some space for the packet header
+		max_bytes = await self._max_packet(conn) - len(head.encode()) - len(tail.encode()) - 1024
+
+		async def flush(rows):
+			try:
+				with db_query_seconds.time(statement="INSERT"):
+					await cur.execute(head + ",".join(rows) + tail)
+			except mysqlErr.Error as e:
+				self.wrap_exc(e)
+
+		rows, size = [], 0
+		for d in chain((first, ), it):
+			row = "(" + ",".join((conn.escape(v) for v in values(d))) + ")"
+			row_size = len(row.encode()) + 1
+			if len(rows) and (len(rows) >= self.insert_rows or size + row_size > max_bytes):
+				await flush(rows)
+				rows, size = [], 0
+			rows.append(row)
+			size += row_size
+		if len(rows):
+			await flush(rows)
+
+	async def stream(self, query, args=None, chunk=10000):
+		""" Yield the query results by lists of up to chunk rows, fetched with an unbuffered cursor """
+		async with (await self.connect()).acquire() as conn:
+			async with conn.cursor(aiomysql.cursors.SSDictCursor) as cur:
+				try:
+					with db_query_seconds.time(statement=self._statement(query)):
+						await cur.execute(query, args)
+					while len(rows := await cur.fetchmany(chunk)):
+						yield rows
+				except mysqlErr.Error as e:
+					self.wrap_exc(e)
 
 	async def close(self):
-		self.pool.close()
-		await self.pool.wait_closed()
+		if self.pool is not None:
+			self.pool.close()
+			await self.pool.wait_closed()
 
 	@staticmethod
 	def wrap_exc(e):
@@ -79,14 +79,14 @@ class FactoryTable:
 			primary_keys=[self.p_key]
 		))
 
-		db.loop.run_until_complete(self.ensure_versions())
+		db.add_check(self.ensure_versions)
 
 	async def ensure_versions(self) -> None:
 		""" Ensure all rows in the table have correct FACTORY_VERSION """
-		if any((
-			row['factory_version'] != FACTORY_VERSION
-			for row in await db.select(['factory_version'], self.name)
-		)):
+		if await db.fetchone(
+			f"SELECT 1 FROM `{self.name}` WHERE `factory_version` IS NULL OR `factory_version` != %s LIMIT 1",
+			[FACTORY_VERSION]
+		):
 			raise ValueError("Not all the existing table rows have the correct factory_version, please run `update_db.py` script.")
 
 	async def get_next_p_key(self) -> int:
@@ -1,17 +1,36 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import stat
+import atexit
+import time
+import json
 import datetime
+from queue import SimpleQueue, Empty
 from threading import Thread
-from multiprocessing import Queue
-import rlcompleter  # this does python autocomplete by tab
-try:
-	import readline
-except ModuleNotFoundError:  # windows support
-	import pyreadline as readline
+from multiprocessing import Queue, parent_process
+import asyncio
 
 from core.config import cfg
 
+# Headless mode runs without the interactive console thread and prints plain log lines,
+# by default it is enabled if stdin is not a terminal (systemd, docker, etc).
+headless = getattr(cfg, 'HEADLESS', None)
+if headless is None:
+	headless = not sys.stdin.isatty()
+
+# CPU executor worker processes (see core/executor.py) import the bot modules too,
+# they only print their log lines and never open log files or read the console input.
+worker_process = parent_process() is not None
+headless = headless or worker_process
+
+if not headless:
+	import rlcompleter  # this does python autocomplete by tab
+	try:
+		import readline
+	except ModuleNotFoundError:  # windows support
+		import pyreadline as readline
+
 LogLevelToInt = {
 	'CHAT': 0,
 	'DEBUG': 1,
@@ -23,64 +42,218 @@ LogLevelToInt = {
 
 
 class Log:
+	"""
+	Log lines are put in a queue and written by a background thread in batches.
+	Messages may be passed with %-style arguments, they are only formatted if the level is enabled.
+	Optional config.cfg variables:
+		LOG_FORMAT - 'text' (default) or 'json' for JSON lines log files.
+		LOG_MAX_SIZE - rotate the log file after this many bytes, 0 to disable.
+		LOG_ROTATE_INTERVAL - rotate the log file after this many seconds, 0 to disable.
+		LOG_FLUSH_INTERVAL - max seconds between the log file flushes.
+	"""
+
+	BATCH_SIZE = 512
 
 	def __init__(self):
+		self.loglevel = LogLevelToInt[cfg.LOG_LEVEL]
+		self.json = getattr(cfg, 'LOG_FORMAT', 'text') == 'json'
+		self.max_size = getattr(cfg, 'LOG_MAX_SIZE', 0)
+		self.rotate_interval = getattr(cfg, 'LOG_ROTATE_INTERVAL', 0)
+		self.flush_interval = getattr(cfg, 'LOG_FLUSH_INTERVAL', 1)
+
+		self.file = None
+		self.file_size = 0
+		self.file_opened_at = 0
+		self.queue = SimpleQueue()
+		self.thread = None
+		if worker_process:
+			return
+
 		# Create log dir if needed
 		if not os.path.exists(os.path.abspath("logs")):
 			os.makedirs('logs')
+		self._open_file()
 
-		self.file = open(datetime.datetime.now().strftime("logs/log_%Y-%m-%d-%H:%M"), 'w')
-		self.loglevel = LogLevelToInt[cfg.LOG_LEVEL]
+		self.thread = Thread(target=self._writer, name="log_writer")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _open_file(self):
+		if self.file is not None:
+			self.file.close()
+		path = datetime.datetime.now().strftime("logs/log_%Y-%m-%d-%H:%M:%S")
+		ext = ".jsonl" if self.json else ""
+		n = 0
+		while os.path.exists(path + (f".{n}" if n else "") + ext):
+			n += 1
+		self.file = open(path + (f".{n}" if n else "") + ext, 'w', encoding='utf-8')
+		self.file_size = 0
+		self.file_opened_at = time.monotonic()
 
 	@staticmethod
 	def display(string):
 		# Have to do this encoding/decoding bullshit because python fails to encode some symbols by default
 		string = string.encode(sys.stdout.encoding, 'ignore').decode(sys.stdout.encoding)
 
+		if headless:
+			sys.stdout.write(string + '\n')
+			return
+
 		# Save user input line, print string and then user input line
 		line_buffer = readline.get_line_buffer()
 		sys.stdout.write("\r\n\033[F\033[K" + string + '\r\n>' + line_buffer)
 
-	def log(self, data, log_level):
-		string = str(data).encode(sys.stdout.encoding, 'ignore').decode(sys.stdout.encoding)
-		string = "{}|{}> {}".format(
-			datetime.datetime.now().strftime("%d.%m.%Y (%H:%M:%S)"),
-			log_level,
-			string)
-		self.display(string)
-		self.file.write(string + '\r\n')
+	@staticmethod
+	def _format_message(data, args):
+		if not len(args):
+			return str(data)
+		try:
+			return str(data) % args
+		except (TypeError, ValueError):
+			return " ".join((str(data), *(str(i) for i in args)))
 
-	def close(self):
+	def _write_batch(self, batch):
+		lines = []
+		for at, log_level, data, args in batch:
+			message = self._format_message(data, args)
+			string = "{}|{}> {}".format(
+				datetime.datetime.fromtimestamp(at).strftime("%d.%m.%Y (%H:%M:%S)"),
+				log_level,
+				message)
+			self.display(string)
+			if self.json:
+				lines.append(json.dumps(dict(at=at, level=log_level, message=message), ensure_ascii=False) + '\n')
+			else:
+				lines.append(string + '\r\n')
+		sys.stdout.flush()
+
+		data = "".join(lines)
+		self.file.write(data)
+		self.file_size += len(data.encode('utf-8'))
+		if (
+			(self.max_size and self.file_size >= self.max_size) or
+			(self.rotate_interval and time.monotonic() - self.file_opened_at >= self.rotate_interval)
+		):
+			self._open_file()
+
+	def _writer(self):
+		closing = False
+		last_flush = time.monotonic()
+		while not closing:
+			# block until the first record, then collect whatever is queued up to the batch size
+			batch = [self.queue.get()]
+			while len(batch) < self.BATCH_SIZE:
+				try:
+					batch.append(self.queue.get_nowait())
+				except Empty:
+					break
+			if batch[-1] is None:  # close() sentinel
+				closing = True
+				batch.pop()
+
+			if len(batch):
+				try:
+					self._write_batch(batch)
+				except Exception as e:
+					sys.stderr.write(f"Failed to write the log: {str(e)}\n")
+
+			if closing or self.queue.empty() or time.monotonic() - last_flush >= self.flush_interval:
+				self.file.flush()
+				last_flush = time.monotonic()
 		self.file.close()
 
-	def chat(self, data):
+	def log(self, data, log_level, *args):
+		if self.thread is None:  # worker process
+			self.display("{}> {}".format(log_level, self._format_message(data, args)))
+			return
+		self.queue.put((time.time(), log_level, data, args))
+
+	def close(self):
+		if self.thread is not None and self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+
+	def chat(self, data, *args):
 		if self.loglevel <= 0:
-			self.log(data, 'CHAT')
+			self.log(data, 'CHAT', *args)
 
-	def debug(self, data):
+	def debug(self, data, *args):
 		if self.loglevel == 1:
-			self.log(data, 'DEBUG')
+			self.log(data, 'DEBUG', *args)
 
-	def command(self, data):
+	def command(self, data, *args):
 		if self.loglevel <= 2:
-			self.log(data, 'COMMANDS')
+			self.log(data, 'COMMANDS', *args)
 
-	def info(self, data):
+	def info(self, data, *args):
 		if self.loglevel <= 3:
-			self.log(data, 'INFO')
+			self.log(data, 'INFO', *args)
 
-	def error(self, data):
+	def error(self, data, *args):
 		if self.loglevel <= 4:
-			self.log(data, 'ERROR')
-		
+			self.log(data, 'ERROR', *args)
+
 
 def user_input():
 	readline.parse_and_bind("tab: complete")
 	while 1:
-		input_cmd = input('>')
+		try:
+			input_cmd = input('>')
+		except EOFError:  # stdin is closed, stop reading instead of spinning
+			log.info("Console input is closed.")
+			return
 		user_input_queue.put(input_cmd)
 
 
+class AdminSocket:
+	"""
+	Local UNIX socket console, an alternative to the interactive console for headless mode.
+	Every received line is passed to the handler coroutine, its result is sent back.
+	"""
+
+	def __init__(self):
+		self.path = None
+		self.srv = None
+		self.handler = None
+
+	async def start(self, path, handler):
+		if os.path.lexists(path):
+			st = os.lstat(path)
+			if st.st_uid != os.getuid() or not stat.S_ISSOCK(st.st_mode):
+				log.error(f"Admin console is not started: {path} exists and is not a socket owned by this user.")
+				return
+			os.remove(path)
+
+		self.path = path
+		self.handler = handler
+		# the commands are evaluated, so the socket must never be accessible by other users, even before a chmod
+		umask = os.umask(0o077)
+		try:
+			self.srv = await asyncio.start_unix_server(self._handle, path=path)
+		finally:
+			os.umask(umask)
+		log.info(f"Admin console is listening on {path}.")
+
+	async def _handle(self, reader, writer):
+		try:
+			while line := await reader.readline():
+				if not (cmd := line.decode(errors='ignore').strip()):
+					continue
+				writer.write((str(await self.handler(cmd)) + '\n').encode())
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def close(self):
+		if self.srv is not None:
+			self.srv.close()
+			await self.srv.wait_closed()
+			if os.path.exists(self.path):
+				os.remove(self.path)
+
+
 def terminate():
 	global alive
 	alive = False
@@ -88,9 +261,12 @@ def terminate():
 
 alive = True
 log = Log()
+atexit.register(log.close)
 user_input_queue = Queue()
+admin_socket = AdminSocket()
 
 # Init user console
-thread = Thread(target=user_input, name="user_input")
-thread.daemon = True
-thread.start()
+if not headless:
+	thread = Thread(target=user_input, name="user_input")
+	thread.daemon = True
+	thread.start()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Optional executor for CPU-bound computations (rating calculations, matchmaking).
+
+Configured with optional config.cfg variables:
+	CPU_EXECUTOR - None (run everything on the event loop), 'thread' or 'process'.
+	CPU_EXECUTOR_WORKERS - pool size, defaults to the concurrent.futures default.
+	CPU_EXECUTOR_THRESHOLD_MS - computations expected to block the loop for less than this are run in place.
+The 'process' pool uses the spawn start method, as forking the threaded bot process could copy locks held by other
+threads into the workers. Functions are pickled by reference and imported by the workers, the arguments (including
+the objects of bound methods) are pickled by value and must not hold local functions or lambdas.
+"""
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from core.config import cfg
+from core.console import log
+from core.metrics import cpu_executor_calls, cpu_executor_seconds
+
+
+def _timed(func, *args):
+	at = time.perf_counter()
+	result = func(*args)
+	return result, time.perf_counter() - at
+
+
+class CPUExecutor:
+	""" Runs CPU-bound functions in a pool if they are expected to block the event loop for too long """
+
+	def __init__(self, kind=None, workers=None, threshold_ms=5):
+		self.kind = kind
+		self.threshold = threshold_ms / 1000.0
+		self.cost_rates = dict()  # {function name: average seconds per cost unit}
+		self.metrics = dict()  # {function name: {on_loop_calls, on_loop_time, off_loop_calls, off_loop_time}}
+
+		if kind is None:
+			self.pool = None
+		elif kind == 'thread':
+			self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu_executor")
+		elif kind == 'process':
+			self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+		else:
+			raise ValueError(f"Unknown CPU_EXECUTOR value '{kind}', must be None, 'thread' or 'process'.")
+
+	def _expected_time(self, name, cost):
+		if cost is None or (rate := self.cost_rates.get(name)) is None:
+			return None
+		return rate * cost
+
+	def _account(self, name, cost, elapsed, off_loop):
+		m = self.metrics.setdefault(name, dict(on_loop_calls=0, on_loop_time=0.0, off_loop_calls=0, off_loop_time=0.0))
+		if off_loop:
+			m['off_loop_calls'] += 1
+			m['off_loop_time'] += elapsed
+		else:
+			m['on_loop_calls'] += 1
+			m['on_loop_time'] += elapsed
+		placement = "off_loop" if off_loop else "on_loop"
+		cpu_executor_calls.inc(function=name, placement=placement)
+		cpu_executor_seconds.inc(elapsed, function=name, placement=placement)
+
+		if cost:
+			rate = elapsed / cost
+			self.cost_rates[name] = rate if name not in self.cost_rates else self.cost_rates[name]*0.8 + rate*0.2
+
+	async def run(self, func, *args, cost=None):
+		"""
+		Execute func(*args) and return its result.
+		The cost is an estimated amount of work units, it is used to predict the execution time from previous calls.
+		Calls with unknown expected time are sent to the pool.
+		"""
+		name = func.__qualname__
+		expected = self._expected_time(name, cost)
+
+		if self.pool is None or (expected is not None and expected < self.threshold):
+			result, elapsed = _timed(func, *args)
+			self._account(name, cost, elapsed, off_loop=False)
+		else:
+			result, elapsed = await asyncio.get_running_loop().run_in_executor(self.pool, _timed, func, *args)
+			self._account(name, cost, elapsed, off_loop=True)
+			log.debug("CPU_EXECUTOR> %s took %.1fms off the loop.", name, elapsed*1000)
+
+		return result
+
+	def stats(self):
+		""" Return human readable metrics string """
+		if not len(self.metrics):
+			return "No CPU executor calls yet."
+		return "\n".join((
+			"{name}: {on_loop_calls} calls / {on_loop_time:.3f}s on loop, {off_loop_calls} calls / {off_loop_time:.3f}s off loop".format(
+				name=name, **m
+			) for name, m in self.metrics.items()
+		))
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.shutdown(wait=False)
+
+
+cpu_executor = CPUExecutor(
+	kind=getattr(cfg, 'CPU_EXECUTOR', None),
+	workers=getattr(cfg, 'CPU_EXECUTOR_WORKERS', None),
+	threshold_ms=getattr(cfg, 'CPU_EXECUTOR_THRESHOLD_MS', 5)
+)
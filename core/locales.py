@@ -1,14 +1,81 @@
 import gettext
-from os import listdir
+import struct
+from os import listdir, path
+from collections import OrderedDict
+
+# Strings looked up on every queue render or removal, they are translated once on the catalog load
+HOT_STRINGS = (
+	"no players",
+	"expire time ran off",
+	"member offline",
+	"member AFK",
+	"member left the guild",
+	"queue started on another channel",
+	"removed by a moderator",
+	"{member} were removed from all queues ({reason}).",
+	"{members} were removed from all queues ({reason}).",
+)
+
+
+def catalog_lang(mo_path):
+	""" Read the '_lang' translation from a compiled catalog without loading the whole catalog """
+	with open(mo_path, 'rb') as f:
+		data = f.read()
+	order = '<' if struct.unpack('<I', data[:4])[0] == gettext.GNUTranslations.LE_MAGIC else '>'
+	count, originals, translations = struct.unpack(order + '3I', data[8:20])
+	for i in range(count):
+		length, offset = struct.unpack(order + '2I', data[originals + i*8:originals + i*8 + 8])
+		if data[offset:offset + length] == b"_lang":
+			length, offset = struct.unpack(order + '2I', data[translations + i*8:translations + i*8 + 8])
+			return data[offset:offset + length].decode()
+	raise ValueError(f"Catalog {mo_path} has no '_lang' string.")
+
+
+class Locale:
+	"""
+	Callable translation function, the catalog is loaded on first use.
+	Some messages are formatted with runtime data before the lookup, so the translations cache is a bounded LRU.
+	"""
+
+	CACHE_SIZE = 1024
+
+	def __init__(self, name, localedir=None, language=None):
+		self.name = name
+		self.localedir = localedir
+		self.language = language
+		self.catalog = None
+		self.hot = dict()  # {message: translation} of HOT_STRINGS
+		self.cache = OrderedDict()  # {message: translation}
+
+	def load(self):
+		if self.localedir is None:
+			self.catalog = gettext.NullTranslations()
+		else:
+			self.catalog = gettext.translation("all", localedir=self.localedir, languages=[self.language])
+		self.hot = {msg: self.catalog.gettext(msg) for msg in HOT_STRINGS}
+
+	def __call__(self, message):
+		if (translation := self.hot.get(message)) is not None:
+			return translation
+		if (translation := self.cache.get(message)) is not None:
+			self.cache.move_to_end(message)
+			return translation
+		if self.catalog is None:
+			self.load()
+			if (translation := self.hot.get(message)) is not None:
+				return translation
+		translation = self.cache[message] = self.catalog.gettext(message)
+		if len(self.cache) > self.CACHE_SIZE:
+			self.cache.popitem(last=False)
+		return translation
+
 
 locales = dict()
 
 for locale_name in listdir("locales/compiled"):
-	t = gettext.translation("all", localedir="locales/compiled", languages=[locale_name])
-	t.install()
-	locales[t.gettext("_lang")] = t.gettext
+	mo_path = path.join("locales/compiled", locale_name, "LC_MESSAGES", "all.mo")
+	lang = catalog_lang(mo_path)
+	locales[lang] = Locale(lang, localedir="locales/compiled", language=locale_name)
 
 # Add default translation
-t = gettext.NullTranslations()
-t.install()
-locales["en"] = t.gettext
\ No newline at end of file
+locales["en"] = Locale("en")
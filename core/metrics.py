@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Runtime metrics in the Prometheus text exposition format.
+
+The HTTP endpoint is configured with optional config.cfg variables:
+	METRICS_ENABLE - serve the metrics, disabled by default.
+	METRICS_HOST, METRICS_PORT - address to listen on, defaults to 127.0.0.1:9108.
+"""
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from core.config import cfg
+from core.console import log
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+	pairs = [*zip(names, values), *extra]
+	if not len(pairs):
+		return ""
+	return "{" + ",".join((f'{name}="{_escape(value)}"' for name, value in pairs)) + "}"
+
+
+class Metric:
+	type = None
+
+	def __init__(self, name, documentation, labels=()):
+		self.name = name
+		self.documentation = documentation
+		self.label_names = tuple(labels)
+		self.values = dict()  # {label values tuple: value}
+
+	def _key(self, labels):
+		if len(labels) != len(self.label_names):
+			raise ValueError(f"Metric {self.name} requires labels {self.label_names}, got {tuple(labels.keys())}.")
+		return tuple((labels[name] for name in self.label_names))
+
+	def samples(self):
+		""" Yield (suffix, label values, extra labels, value) tuples """
+		for key, value in self.values.items():
+			yield "", key, (), value
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+		for suffix, key, extra, value in self.samples():
+			lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} {value}")
+		return "\n".join(lines)
+
+
+class Counter(Metric):
+	type = "counter"
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+	type = "gauge"
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.function = None
+
+	def set(self, value, **labels):
+		self.values[self._key(labels)] = value
+
+	def set_function(self, function):
+		""" Value will be taken from function() on every scrape """
+		self.function = function
+
+	def samples(self):
+		if self.function is not None:
+			try:
+				self.values[()] = self.function()
+			except Exception as e:
+				log.error(f"Failed to collect metric {self.name}: {str(e)}")
+		yield from super().samples()
+
+
+class Histogram(Metric):
+	type = "histogram"
+
+	def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, documentation, labels)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value, **labels):
+		key = self._key(labels)
+		if (data := self.values.get(key)) is None:
+			data = self.values[key] = dict(counts=[0] * (len(self.buckets) + 1), sum=0.0, count=0)
+		data['counts'][bisect_left(self.buckets, value)] += 1
+		data['sum'] += value
+		data['count'] += 1
+
+	@contextmanager
+	def time(self, **labels):
+		at = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - at, **labels)
+
+	def samples(self):
+		for key, data in self.values.items():
+			cumulative = 0
+			for bound, count in zip((*self.buckets, "+Inf"), data['counts']):
+				cumulative += count
+				yield "_bucket", key, (("le", bound), ), cumulative
+			yield "_sum", key, (), data['sum']
+			yield "_count", key, (), data['count']
+
+
+class Registry:
+
+	def __init__(self):
+		self.metrics = []
+
+	def _register(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def counter(self, *args, **kwargs):
+		return self._register(Counter(*args, **kwargs))
+
+	def gauge(self, *args, **kwargs):
+		return self._register(Gauge(*args, **kwargs))
+
+	def histogram(self, *args, **kwargs):
+		return self._register(Histogram(*args, **kwargs))
+
+	def render(self):
+		return "\n".join((m.render() for m in self.metrics)) + "\n"
+
+
+class MetricsServer:
+	""" Minimal HTTP server answering every GET request with the registry contents """
+
+	def __init__(self, registry):
+		self.registry = registry
+		self.srv = None
+
+	async def start(self, host, port):
+		self.srv = await asyncio.start_server(self._handle, host, port)
+		log.info(f"Metrics server is listening on {host}:{port}.")
+
+	async def _handle(self, reader, writer):
+		try:
+			request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+			method, path = request.split(b" ", 2)[:2]
+			if method != b"GET":
+				status, body = "405 Method Not Allowed", ""
+			elif path.split(b"?")[0] not in (b"/", b"/metrics"):
+				status, body = "404 Not Found", ""
+			else:
+				status, body = "200 OK", self.registry.render()
+			body = body.encode()
+			writer.write((
+				f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+				f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+			).encode() + body)
+			await writer.drain()
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def close(self):
+		if self.srv is not None:
+			self.srv.close()
+			await self.srv.wait_closed()
+
+
+class _RateLimitsHandler(logging.Handler):
+	""" Counts rate limit warnings of the discord library, as 429 responses are retried internally """
+
+	def emit(self, record):
+		if record.levelno >= logging.WARNING and 'rate limit' in record.getMessage().lower():
+			discord_rate_limits.inc()
+
+
+def instrument_discord(client):
+	""" Measure REST requests latency and count 429 responses of the discord client """
+	request = client.http.request
+
+	async def timed_request(route, *args, **kwargs):
+		method, path = getattr(route, 'method', '?'), getattr(route, 'path', '?')
+		at = time.perf_counter()
+		try:
+			return await request(route, *args, **kwargs)
+		except Exception as e:
+			if getattr(e, 'status', None) == 429:
+				discord_rate_limits.inc()
+			raise
+		finally:
+			discord_request_seconds.observe(time.perf_counter() - at, method=method, route=path)
+
+	client.http.request = timed_request
+	logging.getLogger('nextcord.http').addHandler(_RateLimitsHandler())
+
+
+def _process_rss():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, AttributeError):
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry = Registry()
+server = MetricsServer(registry)
+
+commands_total = registry.counter(
+	"pubobot_commands_total", "Processed commands by name and outcome.", labels=("command", "outcome")
+)
+command_seconds = registry.histogram(
+	"pubobot_command_seconds", "Commands processing time.", labels=("command", )
+)
+db_query_seconds = registry.histogram(
+	"pubobot_db_query_seconds", "Database queries latency.", labels=("statement", )
+)
+discord_request_seconds = registry.histogram(
+	"pubobot_discord_request_seconds", "Discord REST requests latency.", labels=("method", "route")
+)
+discord_rate_limits = registry.counter(
+	"pubobot_discord_rate_limits_total", "Discord REST rate limit (429) responses."
+)
+cpu_executor_calls = registry.counter(
+	"pubobot_cpu_executor_calls_total", "CPU executor calls by function, run on or off the event loop.",
+	labels=("function", "placement")
+)
+cpu_executor_seconds = registry.counter(
+	"pubobot_cpu_executor_seconds_total", "CPU executor computations time by function, on or off the event loop.",
+	labels=("function", "placement")
+)
+active_queues = registry.gauge("pubobot_active_queues", "Queues with players added.")
+active_matches = registry.gauge("pubobot_active_matches", "Matches in progress.")
+expire_timers = registry.gauge("pubobot_expire_timers", "Scheduled players expire timers.")
+think_lag_seconds = registry.histogram(
+	"pubobot_think_lag_seconds", "Background tasks loop delay over its 1 second period.",
+	buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+process_rss = registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes.")
+process_rss.set_function(_process_rss)
+
+
+async def start(client):
+	""" Start the HTTP endpoint if enabled in the config """
+	if not getattr(cfg, 'METRICS_ENABLE', False):
+		return
+	instrument_discord(client)
+	await server.start(getattr(cfg, 'METRICS_HOST', '127.0.0.1'), getattr(cfg, 'METRICS_PORT', 9108))
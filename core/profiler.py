@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling tools for the operator console:
+	profiler.start(interval_ms=5) - start sampling the main thread stack.
+	profiler.stop() - stop sampling and save collapsed stacks (flamegraph.pl / speedscope format) to logs/.
+	profiler.mem_top(limit=15) - take a tracemalloc snapshot and return the top allocators.
+	profiler.mem_diff(limit=15) - take a tracemalloc snapshot and return the top differences with the previous one.
+	profiler.mem_stop() - stop tracing memory allocations.
+"""
+import os
+import sys
+import time
+import datetime
+import threading
+import tracemalloc
+
+
+class SamplingProfiler:
+	""" Periodically samples the stack of a thread and counts collapsed stacks """
+
+	def __init__(self, thread_id, interval_ms=5):
+		self.thread_id = thread_id
+		self.interval = interval_ms / 1000.0
+		self.stacks = dict()  # {"func (file:line);func (file:line)...": samples count}
+		self.samples = 0
+		self.started_at = None
+		self.alive = False
+		self.thread = None
+
+	def start(self):
+		self.alive = True
+		self.started_at = time.monotonic()
+		self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.alive = False
+		self.thread.join()
+
+	def _run(self):
+		while self.alive:
+			time.sleep(self.interval)
+			frame = sys._current_frames().get(self.thread_id)
+			if frame is None:
+				continue
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+				frame = frame.f_back
+			key = ";".join(reversed(stack))
+			self.stacks[key] = self.stacks.get(key, 0) + 1
+			self.samples += 1
+
+	def dump(self, path):
+		with open(path, 'w') as f:
+			for stack, count in sorted(self.stacks.items(), key=lambda i: i[1], reverse=True):
+				f.write(f"{stack} {count}\n")
+
+
+_sampler = None
+_mem_snapshot = None
+
+
+def start(interval_ms=5):
+	global _sampler
+	if _sampler is not None:
+		return "Profiler is already running."
+	_sampler = SamplingProfiler(threading.main_thread().ident, interval_ms=interval_ms)
+	_sampler.start()
+	return f"Profiler started with {interval_ms}ms sampling interval."
+
+
+def stop():
+	global _sampler
+	if _sampler is None:
+		return "Profiler is not running."
+	sampler, _sampler = _sampler, None
+	sampler.stop()
+
+	path = datetime.datetime.now().strftime("logs/profile_%Y-%m-%d-%H:%M:%S.folded")
+	sampler.dump(path)
+	return "Profiler stopped after {:.1f}s, {} samples saved to {}.".format(
+		time.monotonic() - sampler.started_at, sampler.samples, path
+	)
+
+
+def _take_snapshot():
+	global _mem_snapshot
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+		_mem_snapshot = None
+	previous, _mem_snapshot = _mem_snapshot, tracemalloc.take_snapshot().filter_traces((
+		tracemalloc.Filter(False, tracemalloc.__file__),
+	))
+	return previous, _mem_snapshot
+
+
+def mem_top(limit=15):
+	previous, snapshot = _take_snapshot()
+	stats = snapshot.statistics('lineno')
+	current, peak = tracemalloc.get_traced_memory()
+	return "Traced memory: {:.1f}KiB (peak {:.1f}KiB), top {}:\n{}".format(
+		current / 1024, peak / 1024, limit, "\n".join((str(i) for i in stats[:limit]))
+	)
+
+
+def mem_diff(limit=15):
+	previous, snapshot = _take_snapshot()
+	if previous is None:
+		return "First snapshot is taken, call mem_diff() again to compare."
+	stats = snapshot.compare_to(previous, 'lineno')
+	return "Top {} differences:\n{}".format(limit, "\n".join((str(i) for i in stats[:limit])))
+
+
+def mem_stop():
+	global _mem_snapshot
+	_mem_snapshot = None
+	tracemalloc.stop()
+	return "Memory tracing stopped."
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import random
 import re
+import time
+from collections import OrderedDict
 from prettytable import PrettyTable, MARKDOWN
 from nextcord import Embed
 from nextcord.utils import get, find, escape_markdown
@@ -126,17 +128,89 @@ def seconds_to_str(seconds):
 	return str(timedelta(seconds=seconds))
 
 
+RATING_TAG_RE = re.compile(r"^\[\d+\] (.+)")
+ESCAPE_CB_RE = re.compile(r"([`<>\*_\\\[\]\~])|((?=\s)[^ ])")
+
+
 def escape_cb(string):
 	""" Removes bad characters for string inside a dc codeblock """
-	return re.sub(r"([`<>\*_\\\[\]\~])|((?=\s)[^ ])", "", string)
+	return ESCAPE_CB_RE.sub("", string)
+
+
+class NickCache:
+	""" Bounded LRU cache of processed nicks, keyed by member id and raw nick """
+
+	def __init__(self, size=4096):
+		self.size = size
+		self._data = OrderedDict()  # {user_id: (raw_nick, nick)}
+
+	def get(self, user):
+		raw = user.nick or user.name
+		if (cached := self._data.get(user.id)) is not None and cached[0] == raw:
+			self._data.move_to_end(user.id)
+			return cached[1]
+
+		string = raw
+		if x := RATING_TAG_RE.match(string):
+			string = x.group(1)
+		nick = escape_cb(string)
+
+		self._data[user.id] = (raw, nick)
+		self._data.move_to_end(user.id)
+		if len(self._data) > self.size:
+			self._data.popitem(last=False)
+		return nick
+
+	def invalidate(self, user_id):
+		self._data.pop(user_id, None)
+
+	def clear(self):
+		self._data.clear()
+
+
+class TTLCache:
+	""" Bounded cache of values expiring after ttl seconds, grouped for bulk invalidation """
+
+	def __init__(self, ttl=60, size=4096):
+		self.ttl = ttl
+		self.size = size
+		self._data = dict()  # {group: {key: (expires_at, value)}}
+		self._order = OrderedDict()  # {(group, key): expires_at} in the expiration order, as the ttl is constant
+
+	def get(self, group, key):
+		if (cached := self._data.get(group, {}).get(key)) is not None and cached[0] > time.monotonic():
+			return cached[1]
+		return None
+
+	def set(self, group, key, value):
+		now = time.monotonic()
+		self._data.setdefault(group, dict())[key] = (now + self.ttl, value)
+		self._order[(group, key)] = now + self.ttl
+		self._order.move_to_end((group, key))
+
+		# purge the expired entries and the oldest ones above the size limit
+		while len(self._order) and (len(self._order) > self.size or next(iter(self._order.values())) <= now):
+			(old_group, old_key), expires_at = self._order.popitem(last=False)
+			if (entries := self._data.get(old_group)) is not None:
+				entries.pop(old_key, None)
+				if not len(entries):
+					self._data.pop(old_group)
+
+	def invalidate(self, group):
+		for key in self._data.pop(group, dict()).keys():
+			self._order.pop((group, key), None)
+
+	def clear(self):
+		self._data.clear()
+		self._order.clear()
+
+
+nick_cache = NickCache()
 
 
 def get_nick(user):
 	""" Remove rating tag and text formatting characters """
-	string = user.nick or user.name
-	if x := re.match(r"^\[\d+\] (.+)", string):
-		string = x.group(1)
-	return escape_cb(string)
+	return nick_cache.get(user)
 
 
 def discord_table(header, rows):
@@ -166,6 +240,29 @@ def split_big_text(string: str, limit: int = 2000, delimiter: str = None, prefix
 		yield prefix + string + suffix
 
 
+class PrefixTrie:
+	""" Prefix tree returning all values stored under keys starting with a given prefix """
+
+	def __init__(self, items=()):
+		self.root = dict()  # {char: node}, node[None] holds values of all keys below the node
+		for key, value in items:
+			self.add(key, value)
+
+	def add(self, key, value):
+		node = self.root
+		node.setdefault(None, []).append(value)
+		for c in key:
+			node = node.setdefault(c, dict())
+			node.setdefault(None, []).append(value)
+
+	def find(self, prefix):
+		node = self.root
+		for c in prefix:
+			if (node := node.get(c)) is None:
+				return []
+		return list(node.get(None, []))
+
+
 class SafeTemplateDict(dict):
 	""" returns {key} for missing keys, useful for string.format_map() """
 	def __missing__(self, key):
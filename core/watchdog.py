@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop stall watchdog.
+
+A heartbeat callback is scheduled on the event loop, a separate thread checks that it keeps ticking.
+If the loop did not tick for longer than WATCHDOG_STALL_MS (optional config.cfg variable, 0 disables the watchdog)
+the main thread stack is logged and the stall is counted for the offending call site.
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from core.config import cfg
+from core.console import log
+
+ROOT_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+
+class Watchdog:
+
+	def __init__(self, stall_ms=1000):
+		self.threshold = stall_ms / 1000.0
+		self.interval = self.threshold / 4
+		self.loop = None
+		self.loop_thread_id = None
+		self.last_tick = time.monotonic()
+		self.stalls = dict()  # {call site: {count, total_time, max_time}}
+		self.thread = None
+		self.alive = False
+
+	def start(self, loop):
+		""" Must be called from the event loop thread """
+		if not self.threshold or self.thread is not None:
+			return
+		self.loop = loop
+		self.loop_thread_id = threading.get_ident()
+		self.alive = True
+		self.last_tick = time.monotonic()
+		self.loop.call_soon(self._tick)
+		self.thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.alive = False
+
+	def _tick(self):
+		self.last_tick = time.monotonic()
+		if self.alive:
+			self.loop.call_later(self.interval, self._tick)
+
+	def _watch(self):
+		stalled_since = None  # last_tick value of the stall being tracked
+		stall_site = None
+		while self.alive:
+			time.sleep(self.interval)
+			last_tick = self.last_tick
+			lag = time.monotonic() - last_tick
+
+			if lag < self.threshold:
+				if stalled_since is not None:
+					self._finish_stall(stall_site, last_tick - stalled_since)
+					stalled_since = None
+				continue
+
+			if stalled_since is None or stalled_since != last_tick:
+				if stalled_since is not None:
+					self._finish_stall(stall_site, last_tick - stalled_since)
+				stalled_since = last_tick
+				stall_site = self._report_stall(lag)
+
+	def _report_stall(self, lag):
+		frame = sys._current_frames().get(self.loop_thread_id)
+		if frame is None:
+			return None
+
+		stack = traceback.extract_stack(frame)
+		site = self.call_site(stack)
+		task = asyncio.current_task(self.loop)
+		coro = task.get_coro() if task else None
+		log.error("WATCHDOG> Event loop stalled for {:.0f}ms at {}, running {}.\n{}".format(
+			lag * 1000, site, getattr(coro, '__qualname__', repr(coro)), "".join(traceback.format_list(stack[-15:]))
+		))
+		return site
+
+	def _finish_stall(self, site, duration):
+		if site is None:
+			return
+		s = self.stalls.setdefault(site, dict(count=0, total_time=0.0, max_time=0.0))
+		s['count'] += 1
+		s['total_time'] += duration
+		s['max_time'] = max(s['max_time'], duration)
+
+	@staticmethod
+	def call_site(stack):
+		""" Return innermost 'module:function:line' of the bot code from an extracted stack """
+		for fs in reversed(stack):
+			path = os.path.abspath(fs.filename)
+			if path.startswith(ROOT_DIR) and os.sep + "site-packages" + os.sep not in path:
+				module = os.path.splitext(os.path.relpath(path, ROOT_DIR))[0].replace(os.sep, '.')
+				return f"{module}:{fs.name}:{fs.lineno}"
+		fs = stack[-1]
+		return f"{fs.filename}:{fs.name}:{fs.lineno}"
+
+	def stats(self):
+		""" Return human readable stall counters string """
+		if not len(self.stalls):
+			return "No event loop stalls detected."
+		return "\n".join((
+			"{site}: {count} stalls, {total:.3f}s total, {max:.3f}s max".format(
+				site=site, count=s['count'], total=s['total_time'], max=s['max_time']
+			) for site, s in sorted(self.stalls.items(), key=lambda i: i[1]['total_time'], reverse=True)
+		))
+
+
+watchdog = Watchdog(stall_ms=getattr(cfg, 'WATCHDOG_STALL_MS', 1000))
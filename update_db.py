@@ -74,4 +74,5 @@ async def main():
 			await db.execute(f'ALTER TABLE pq_configs DROP COLUMN `{name}`')
 			await db.execute(f'ALTER TABLE pq_configs CHANGE pq_id pq_id bigint(20) AUTO_INCREMENT')
 
+db.loop.run_until_complete(db.migrate())
 db.loop.run_until_complete(main())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rebuild the daily activity rollup (qc_activity table) from the matches tables.
+The rollup is filled automatically on the first start after an update, use this tool to repair it.
+
+Usage (from the bot directory, config.cfg must be present):
+	python3 utils/backfill_activity.py [--channel CHANNEL_ID]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.getcwd())
+
+from core.console import log
+from core.database import db
+import bot
+
+
+async def run(channel_id):
+	await db.migrate()
+	at = time.perf_counter()
+	await bot.stats.rebuild_activity(channel_id)
+	log.info(f"Activity rollup rebuilt in {time.perf_counter() - at:.2f}s.")
+	await db.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Rebuild the daily activity rollup.")
+	parser.add_argument("--channel", type=int, default=None, help="Rebuild only the specified channel.")
+	args = parser.parse_args()
+
+	asyncio.get_event_loop().run_until_complete(run(args.channel))
+	log.close()
+
+
+if __name__ == "__main__":
+	main()
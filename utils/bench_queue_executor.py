@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stress benchmark for the per-channel commands serialization (QueueChannel.execute).
+Fires concurrent add commands at simulated queue channels, checks the queues invariants and prints throughput.
+Discord and database calls on the add command path are replaced with stubs yielding to the event loop.
+
+Usage (from the bot directory, config.cfg must be present):
+	python3 utils/bench_queue_executor.py [--adds N] [--channels N] [--size N] [--unserialized]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.getcwd())
+
+from core.client import FakeMember
+import bot
+
+
+async def _yield(*args, **kwargs):
+	await asyncio.sleep(0)
+
+
+async def _yield_result(result):
+	await asyncio.sleep(0)
+	return result
+
+
+def _qc_cfg():
+	return SimpleNamespace(
+		lang="en", rating_system="flat", rating_channel=None, rating_initial=1500, rating_deviation=200,
+		rating_min_deviation=75, rating_scale=100, rating_loss_scale=100, rating_win_scale=100, rating_draw_bonus=0,
+		rating_ws_boost=0, rating_ls_boost=0, blacklist_role=None, whitelist_role=None, expire_time=None,
+		promotion_role=None, remove_afk=0, remove_offline=0, ranks=[], cfg_info={}
+	)
+
+
+def _pq_cfg(pq_id, size):
+	return SimpleNamespace(
+		p_key=pq_id, name="bench", size=size, aliases=[], is_default=1, autostart=1, ranked=0,
+		blacklist_role=None, whitelist_role=None, start_direct_msg=None, team_size=None, team_names=None,
+		team_emojis=None, pick_captains="no captains", captains_role=None, pick_teams="no teams", pick_order=None,
+		maps=[], vote_maps=None, map_count=0, check_in_timeout=None, check_in_discard=1, match_lifetime=None,
+		start_msg=None, server=None, promotion_role=None
+	)
+
+
+def create_channel(channel_id, size):
+	guild = SimpleNamespace(id=channel_id, name=f"bench-guild-{channel_id}")
+	text_channel = SimpleNamespace(id=channel_id, name="bench", mention=f"<#{channel_id}>", guild=guild)
+	qc = bot.QueueChannel(text_channel, _qc_cfg())
+	qc.queues.append(bot.PickupQueue(qc, _pq_cfg(channel_id, size)))
+	qc.update_expire = _yield
+	qc._dm_members = _yield
+	return qc, text_channel
+
+
+async def run(adds, channels, size, serialized):
+	started = []  # [(qc, players)]
+
+	async def new_match(ctx, queue, players, **kwargs):
+		await asyncio.sleep(0)
+		bot.active_matches.add(SimpleNamespace(id=len(started), qc=queue.qc, players=list(players)))
+		started.append((queue.qc, list(players)))
+
+	bot.Match.new = new_match
+	bot.noadds.get_user = lambda ctx, member: _yield_result([0, None])
+
+	qcs = [create_channel(1000+i, size) for i in range(channels)]
+	members = [FakeMember(guild=None, user_id=i, name=f"player{i}") for i in range(adds)]
+
+	async def add(qc, channel, member):
+		ctx = bot.Context(qc, channel, member)
+		coro = bot.commands.add(ctx)
+		try:
+			await (qc.execute(coro) if serialized else coro)
+		except bot.Exc.PubobotException:
+			pass
+
+	# every member sends the add command twice at once
+	tasks = []
+	for n, member in enumerate(members):
+		qc, channel = qcs[n % channels]
+		tasks += [add(qc, channel, member), add(qc, channel, member)]
+
+	at = time.perf_counter()
+	await asyncio.gather(*tasks)
+	elapsed = time.perf_counter() - at
+
+	errors = []
+	matched = dict()  # {user_id: match number}
+	for n, (qc, players) in enumerate(started):
+		if len(players) != size or len(set(players)) != size:
+			errors.append(f"Match #{n} on {qc.id} started with {len(players)} players ({len(set(players))} unique).")
+		for p in players:
+			if p.id in matched:
+				errors.append(f"Player {p.id} started in matches #{matched[p.id]} and #{n}.")
+			matched[p.id] = n
+
+	for qc, channel in qcs:
+		for q in qc.queues:
+			if q.length >= size:
+				errors.append(f"Queue on {qc.id} is overfilled: {q.length}/{size}.")
+			if len(set(q.queue)) != q.length:
+				errors.append(f"Queue on {qc.id} has duplicate players.")
+			for p in q.queue:
+				if p.id in matched:
+					errors.append(f"Player {p.id} is queued on {qc.id} while in match #{matched[p.id]}.")
+				matched.setdefault(p.id, None)
+
+	if len(matched) != adds:
+		errors.append(f"Lost players: {adds - len(matched)}.")
+
+	print(f"Mode: {'serialized' if serialized else 'unserialized'}, channels: {channels}, queue size: {size}.")
+	print(f"Processed {len(tasks)} add commands in {elapsed:.3f}s ({len(tasks)/elapsed:.0f} commands/s).")
+	print(f"Started {len(started)} matches.")
+	if len(errors):
+		print(f"Invariants violated ({len(errors)}):")
+		print("\n".join(errors[:20]))
+	else:
+		print("All invariants hold.")
+	return not len(errors)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="QueueChannel commands serialization stress benchmark.")
+	parser.add_argument("--adds", type=int, default=5000, help="Amount of members adding to the queues.")
+	parser.add_argument("--channels", type=int, default=10, help="Amount of simulated queue channels.")
+	parser.add_argument("--size", type=int, default=8, help="Queue size.")
+	parser.add_argument("--unserialized", action="store_true", help="Run commands without QueueChannel.execute.")
+	args = parser.parse_args()
+
+	loop = asyncio.get_event_loop()
+	ok = loop.run_until_complete(run(args.adds, args.channels, args.size, not args.unserialized))
+	sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+	main()